@@ -0,0 +1,199 @@
+#api_scheduler.py
+# Every Wyze lock API call is queued here. A token bucket keeps the whole fleet under the API rate limit,
+# a lock only ever has one mutation (create/update/delete) in flight, and calls that fail with a
+# transient error go back in the queue with jittered exponential backoff instead of being dropped.
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from wyze_sdk.errors import WyzeApiError
+
+# Sustained calls per second across all locks (0 disables the limit) and how many can go out back to back
+API_RATE_PER_SECOND = float(os.getenv('API_RATE_PER_SECOND', '2'))
+API_BURST = int(os.getenv('API_BURST', '10'))
+# Calls running at the same time
+API_MAX_IN_FLIGHT = int(os.getenv('API_MAX_IN_FLIGHT', '4'))
+# Attempts per call before the error is handed back to the caller, and the backoff between them in seconds
+API_MAX_ATTEMPTS = int(os.getenv('API_MAX_ATTEMPTS', '5'))
+API_BACKOFF_BASE = float(os.getenv('API_BACKOFF_BASE', '1'))
+API_BACKOFF_MAX = float(os.getenv('API_BACKOFF_MAX', '60'))
+
+
+# Throttling, server errors and network trouble are worth retrying; bad parameters or an unknown key are not
+def is_transient_error(e):
+    if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(e, requests.HTTPError):
+        status = e.response.status_code if e.response is not None else 0
+        return status == 429 or status >= 500
+    if isinstance(e, WyzeApiError):
+        # the SDK's services raise with a WyzeResponse (FordResponse for locks), whose body is in .data
+        status = getattr(e.response, 'status_code', None) or 0
+        if status == 429 or status >= 500:
+            return True
+        data = getattr(e.response, 'data', e.response)
+        if not isinstance(data, dict):
+            data = {}
+        msg = str(data.get('msg', data.get('description', ''))).lower()
+        try:
+            code = int(data.get('code', data.get('errorCode', 0)))
+        except (TypeError, ValueError):
+            code = 0
+        return code >= 5000 or 'limit' in msg or 'too many' in msg or 'busy' in msg
+    return False
+
+
+# Full jitter: a random wait up to the exponential backoff for this attempt
+def backoff_delay(attempt, base=API_BACKOFF_BASE, cap=API_BACKOFF_MAX):
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.clock = clock
+        self.tokens = float(self.burst)
+        self.updated = clock()
+
+    # Take a token if one is available, otherwise return how many seconds until there is one
+    def take(self):
+        if self.rate <= 0:
+            return 0.0
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class ApiScheduler:
+    def __init__(self, rate=API_RATE_PER_SECOND, burst=API_BURST, max_in_flight=API_MAX_IN_FLIGHT,
+                 max_attempts=API_MAX_ATTEMPTS, clock=time.monotonic):
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self.heap = []  # [ready_at, seq, call]
+        self.counter = itertools.count()
+        self.busy = set()  # locks with a mutation in flight
+        self.waiting = {}  # device_mac -> entries queued behind that mutation
+        self.cond = threading.Condition()
+        self.slots = threading.Semaphore(max_in_flight)
+        self.pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='wyze-api')
+        self.counts = Counter()
+        self.dispatcher = None
+        self.stopped = False
+
+    # Queue fn() and return a Future for its result. Mutations of the same lock run one at a time
+    def submit(self, fn, device_mac=None, mutation=False):
+        call = {'fn': fn, 'device_mac': device_mac if mutation else None, 'attempt': 0, 'future': Future()}
+        with self.cond:
+            if self.dispatcher is None or not self.dispatcher.is_alive():
+                self.stopped = False
+                self.dispatcher = threading.Thread(target=self._run, name="wyze-api-scheduler", daemon=True)
+                self.dispatcher.start()
+            self._push(call, self.clock())
+        return call['future']
+
+    # Queue fn() and wait for it, raising the last error once every attempt failed
+    def call(self, fn, device_mac=None, mutation=False):
+        return self.submit(fn, device_mac=device_mac, mutation=mutation).result()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return dict(self.counts, queued=len(self.heap) + sum(len(entries) for entries in self.waiting.values()))
+
+    def _push(self, call, ready_at):
+        heapq.heappush(self.heap, [ready_at, next(self.counter), call])
+        self.cond.notify()
+
+    # Next call that is due and whose lock is free, parking calls for a busy lock until it is released
+    def _next_ready(self):
+        now = self.clock()
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            device_mac = entry[2]['device_mac']
+            if device_mac is None:
+                return entry[2]
+            if device_mac in self.busy:
+                self.waiting.setdefault(device_mac, []).append(entry)
+                continue
+            self.busy.add(device_mac)
+            return entry[2]
+        return None
+
+    def _release(self, device_mac):
+        if device_mac is None:
+            return
+        self.busy.discard(device_mac)
+        for entry in self.waiting.pop(device_mac, []):
+            heapq.heappush(self.heap, entry)  # keeps its original place in the queue
+
+    def _run(self):
+        while True:
+            with self.cond:
+                call = self._next_ready()
+                while call is None:
+                    if self.stopped:
+                        return
+                    self.cond.wait(max(self.heap[0][0] - self.clock(), 0) if self.heap else None)
+                    call = self._next_ready()
+            delay = self.bucket.take()
+            while delay:
+                self.counts['throttled'] += 1
+                time.sleep(delay)
+                delay = self.bucket.take()
+            self.slots.acquire()
+            self.pool.submit(self._execute, call)
+
+    def _execute(self, call):
+        call['attempt'] += 1
+        error = None
+        try:
+            result = call['fn']()
+        except Exception as e:
+            error = e
+        retry = error is not None and is_transient_error(error) and call['attempt'] < self.max_attempts
+        with self.cond:
+            self.counts['calls'] += 1
+            self._release(call['device_mac'])
+            if retry:
+                self.counts['retries'] += 1
+                delay = backoff_delay(call['attempt'])
+                print(f"Wyze API call failed (attempt {call['attempt']}), retrying in {delay:.1f}s: {error}")
+                self._push(call, self.clock() + delay)
+            elif error is not None:
+                self.counts['failures'] += 1
+            self.cond.notify()
+        self.slots.release()
+        if retry:
+            return
+        if error is not None:
+            call['future'].set_exception(error)
+        else:
+            call['future'].set_result(result)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ApiScheduler()
+    return _scheduler
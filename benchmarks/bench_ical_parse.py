@@ -0,0 +1,85 @@
+#bench_ical_parse.py
+# Compares the icalendar based parser with the streaming parser on synthetic Airbnb feeds.
+# Usage: python benchmarks/bench_ical_parse.py --events 10000 --repeat 5
+import argparse
+import os
+import re
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from icalendar import Calendar
+
+import ical_stream
+from fakes import synthetic_feed
+
+
+# The parser fetch_airbnb_bookings used before the streaming one, kept here as the reference
+def parse_with_icalendar(ical_text):
+    calendar = Calendar.from_ical(ical_text)
+    bookings = []
+    for component in calendar.walk():
+        if component.name == "VEVENT" and 'Reserved' in component.get('SUMMARY'):
+            description = component.get('DESCRIPTION')
+            phone_match = re.search(r'Phone Number \(Last 4 Digits\): (\d{4})', description)
+            if phone_match:
+                phone_last4 = phone_match.group(1)
+                check_in = component.get('DTSTART').dt
+                check_out = component.get('DTEND').dt
+                days_stay = (check_out - check_in).days
+                guest_name = f"{check_in.strftime('%a')}-{days_stay}days"
+                uid = component.get('UID')
+                bookings.append({
+                    'uid': str(uid) if uid else f"{check_in.isoformat()}-{phone_last4}",
+                    'check_in': check_in,
+                    'check_out': check_out,
+                    'guest_phone_last4': phone_last4,
+                    'guest_name': guest_name
+                })
+    return bookings
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="iCal parser benchmark")
+    parser.add_argument('--events', type=int, default=10000, help="Number of VEVENTs in the synthetic feed")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per parser, the best one is reported")
+    parser.add_argument('--window-days', type=int, default=30, help="Window used for the bounded streaming run")
+    args = parser.parse_args()
+
+    feed = synthetic_feed(args.events)
+    lines = feed.splitlines()
+    print(f"Feed: {args.events} events, {len(feed) / 1024:.0f} KiB")
+
+    reference_time, reference = best_of(args.repeat, lambda: parse_with_icalendar(feed))
+    stream_time, streamed = best_of(args.repeat, lambda: ical_stream.parse_bookings(lines))
+    if streamed != reference:
+        print("ERROR: streaming parser output differs from icalendar parser")
+        sys.exit(1)
+
+    # a window in the middle of the feed, like a daemon only caring about the next few weeks
+    middle = reference[len(reference) // 2]['check_in']
+    window_end = middle + timedelta(days=args.window_days)
+    window_time, windowed = best_of(args.repeat, lambda: ical_stream.parse_bookings(lines, start=middle, end=window_end))
+    expected = [b for b in reference if b['check_out'] >= middle and b['check_in'] <= window_end]
+    if windowed != expected:
+        print("ERROR: windowed streaming parser output differs from filtered icalendar output")
+        sys.exit(1)
+
+    print(f"icalendar:        {reference_time * 1000:8.1f} ms  ({len(reference)} bookings)")
+    print(f"stream:           {stream_time * 1000:8.1f} ms  ({len(streamed)} bookings, {reference_time / stream_time:.1f}x)")
+    print(f"stream {args.window_days:>3}d window: {window_time * 1000:8.1f} ms  ({len(windowed)} bookings, {reference_time / window_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#bench_startup.py
+# Startup time of each CLI mode, measured as the wall time of a fresh process the way cron or a
+# shell would run it, together with which heavy dependencies the mode ended up importing.
+# --list-upcoming runs once against an empty state store (feeds are downloaded from a local iCal
+# server) and then against the filled store, which is what repeated runs see.
+# Usage: python benchmarks/bench_startup.py --homes 10 --repeat 5
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, '..')
+SCRIPT = os.path.abspath(os.path.join(ROOT, 'wyze-lock-airbnb.py'))
+sys.path.insert(0, BENCH_DIR)
+
+from fakes import IcalServer
+
+HEAVY_MODULES = ('wyze_sdk', 'requests', 'pytz', 'smtplib', 'http.server', 'sqlite3', 'concurrent.futures')
+
+# Runs the script as __main__ and reports the modules it imported on exit. A local .env is ignored
+# so only the homes set up here are used
+RUNNER = """
+import atexit, json, runpy, sys
+import dotenv
+dotenv.load_dotenv = lambda *args, **kwargs: False
+script, heavy = sys.argv[1], sys.argv[2].split(',')
+sys.argv = [script] + sys.argv[3:]
+atexit.register(lambda: print(json.dumps([name for name in heavy if name in sys.modules]), file=sys.stderr))
+runpy.run_path(script, run_name='__main__')
+"""
+
+
+def run_once(args, env):
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, '-c', RUNNER, SCRIPT, ','.join(HEAVY_MODULES)] + args,
+                             env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - started
+    modules = json.loads(process.stderr.strip().splitlines()[-1]) if process.stderr.strip() else []
+    return elapsed, modules
+
+
+def measure(name, args, env, repeat):
+    runs = [run_once(args, env) for _ in range(repeat)]
+    times = [elapsed for elapsed, modules in runs]
+    return {'mode': name, 'median': statistics.median(times), 'min': min(times), 'modules': runs[-1][1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time of each CLI mode")
+    parser.add_argument('--homes', type=int, default=10, help="Homes configured for --list-upcoming")
+    parser.add_argument('--events', type=int, default=50, help="VEVENTs per feed")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per mode, the median is reported")
+    parser.add_argument('--json', action='store_true', help="Print raw results as JSON lines")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp, IcalServer(args.homes, events=args.events) as feeds:
+        env = {key: value for key, value in os.environ.items() if not key.startswith(('HOME_', 'WYZE_', 'SMTP_'))}
+        env.update({
+            'FEED_CACHE_PATH': os.path.join(tmp, 'feed_cache.json'),
+            'STATE_DB_PATH': os.path.join(tmp, 'state.db'),
+            'WYZE_ENV_FILE': os.path.join(tmp, '.env'),
+            'PYTHONPATH': os.path.abspath(ROOT),
+        })
+        for n in range(1, args.homes + 1):
+            env[f'HOME_{n}_NAME'] = f'Bench Home {n}'
+            env[f'HOME_{n}_ICAL_URL'] = feeds.url(n - 1)
+            env[f'HOME_{n}_LOCK_DEVICE_MAC'] = f'FAKE{n:08d}'
+            env[f'HOME_{n}_CHECK_IN_TIME'] = '16:00'
+            env[f'HOME_{n}_CHECK_OUT_TIME'] = '11:00'
+
+        # the interpreter alone, the floor for every mode
+        times = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, '-c', 'pass'], env=env)
+            times.append(time.perf_counter() - started)
+        results.append({'mode': 'python -c pass', 'median': statistics.median(times), 'min': min(times), 'modules': []})
+        results.append(measure('--help', ['--help'], env, args.repeat))
+        # without SMTP settings the mode stops right after checking them, so only startup is measured
+        results.append(measure('--testemail', ['--testemail'], env, args.repeat))
+        results.append(measure('--list-upcoming (empty store)', ['--list-upcoming'], env, 1))
+        results.append(measure('--list-upcoming', ['--list-upcoming'], env, args.repeat))
+
+    for result in results:
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"{result['mode']:<32} {result['median'] * 1000:8.1f} ms  (min {result['min'] * 1000:.1f} ms)  imports: {', '.join(result['modules']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#bench_sync.py
+# Load test for a full sync cycle, run entirely offline: feeds come from a local iCal server,
+# lock calls go to a fake Wyze client and emails to a local SMTP sink.
+# Each scale runs in its own process so caches, the state store and peak memory start fresh.
+# Usage: python benchmarks/bench_sync.py --homes 1 10 100 1000 --events 50 --latency 0.02
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from fakes import FakeClient, FakeLocks, IcalServer, SmtpSink
+
+
+def load_script():
+    # the benchmark sets up its own environment, don't let a local .env add real homes
+    import dotenv
+    dotenv.load_dotenv = lambda *args, **kwargs: False
+    spec = importlib.util.spec_from_file_location('wyze_lock_airbnb', os.path.join(ROOT, 'wyze-lock-airbnb.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Provisioned bookings in the state store whose code is not on their lock, 0 after a correct sync.
+# With several homes per lock this catches one home pruning another home's codes
+def missing_codes(script, lock_keys):
+    import reconcile
+    import state_store
+    now = script.now_utc()
+    rows = [row for row in state_store.get_store().all_bookings() if row['provisioned_at'] and row['check_out'] > now]
+    on_lock = {}
+    for device_mac in {row['device_mac'] for row in rows}:
+        on_lock[device_mac] = {(key.name, reconcile.key_end(key)) for key in lock_keys.get(device_mac, {}).values()}
+    return sum((row['name'], reconcile.end_stamp(row['check_out'])) not in on_lock[row['device_mac']] for row in rows)
+
+
+def run_scale(homes, args):
+    results = {'homes': homes, 'stages': []}
+    with tempfile.TemporaryDirectory() as tmp, IcalServer(homes, events=args.events) as feeds, SmtpSink() as sink:
+        for n in range(1, homes + 1):
+            os.environ[f'HOME_{n}_NAME'] = f'Bench Home {n}'
+            os.environ[f'HOME_{n}_ICAL_URL'] = feeds.url(n - 1)
+            os.environ[f'HOME_{n}_LOCK_DEVICE_MAC'] = f'FAKE{(n - 1) // args.homes_per_lock + 1:08d}'
+            os.environ[f'HOME_{n}_CHECK_IN_TIME'] = '16:00'
+            os.environ[f'HOME_{n}_CHECK_OUT_TIME'] = '11:00'
+        os.environ.update({
+            'FEED_CACHE_PATH': os.path.join(tmp, 'feed_cache.json'),
+            'STATE_DB_PATH': os.path.join(tmp, 'state.db'),
+            'WYZE_ENV_FILE': os.path.join(tmp, '.env'),
+            'WYZE_ACCESS_TOKEN': 'bench',
+            'SMTP_HOST': '127.0.0.1',
+            'SMTP_PORT': str(sink.port),
+            'SMTP_FROM': 'bench@localhost',
+            'MAIL_TO': 'host@localhost',
+            'SMTP_STARTTLS': 'false',
+            'API_RATE_PER_SECOND': str(args.rate),
+            'API_BACKOFF_BASE': '0.05',
+        })
+        script = load_script()
+        # the script imports these on first use, they read the environment set up above
+        import api_scheduler
+        import lock_backends
+        import notifier
+        if args.backend == 'memory':
+            # batches go out as one request each, latency is added per request
+            backend = lock_backends.InMemoryLockBackend(latency=args.latency)
+            lock_requests = backend.requests
+            lock_keys = backend.keys
+        else:
+            # calls still go through the API scheduler, only the token manager is bypassed
+            locks = FakeLocks(latency=args.latency, error_rate=args.error_rate)
+            backend = lock_backends.WyzeLockBackend(client=FakeClient(locks))
+            lock_requests = locks.calls
+            lock_keys = locks.keys
+        lock_backends.use_backend(backend)
+
+        def stage(name, fn):
+            calls, requests, mails = sum(lock_requests.values()), dict(feeds.requests), len(sink.messages)
+            with contextlib.redirect_stdout(io.StringIO()):
+                started = time.perf_counter()
+                fn()
+                elapsed = time.perf_counter() - started
+                notifier.get_dispatcher().close()
+            results['stages'].append({
+                'stage': name,
+                'seconds': elapsed,
+                'api_calls': sum(lock_requests.values()) - calls,
+                'feeds_200': feeds.requests['200'] - requests.get('200', 0),
+                'feeds_304': feeds.requests['304'] - requests.get('304', 0),
+                'emails': len(sink.messages) - mails,
+            })
+
+        # one feed after another, then the cache is written once like at the end of a sync cycle
+        def fetch_each():
+            import feed_cache
+            for home in script.get_homes():
+                script.fetch_airbnb_bookings(home.ical_url)
+            feed_cache.get_cache().flush()
+
+        stage('fetch (cold)', fetch_each)
+        stage('fetch (unchanged)', fetch_each)
+        stage('process_bookings (initial)', script.process_bookings)
+        stage('process_bookings (steady)', script.process_bookings)
+        results['missing_codes'] = missing_codes(script, lock_keys)
+        feeds.churn(args.churn)
+        stage(f'process_bookings ({args.churn:.0%} churn)', script.process_bookings)
+        until = datetime.now() + timedelta(days=7)
+        stage('delete_access_codes (+7d)', lambda: [script.delete_access_codes(home.lock_device_mac, until) for home in script.get_homes()])
+        stage('list_upcoming_bookings', script.list_upcoming_bookings)
+
+        results['backend'] = backend.name
+        results['api_calls_by_op'] = dict(lock_requests)
+        results['scheduler'] = api_scheduler.get_scheduler().stats()
+        results['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return results
+
+
+def print_results(results):
+    print(f"\n{results['homes']} homes ({results['backend']} backend), peak RSS {results['peak_rss_mb']:.0f} MiB, API calls {results['api_calls_by_op']}")
+    print(f"  scheduler {results['scheduler']}, provisioned codes missing from their lock: {results['missing_codes']}")
+    print(f"  {'stage':<32} {'seconds':>9} {'api calls':>10} {'feeds 200':>10} {'feeds 304':>10} {'emails':>7}")
+    for row in results['stages']:
+        print(f"  {row['stage']:<32} {row['seconds']:>9.3f} {row['api_calls']:>10} {row['feeds_200']:>10} {row['feeds_304']:>10} {row['emails']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync cycle load test against local fakes")
+    parser.add_argument('--homes', type=int, nargs='+', default=[1, 10, 100, 1000], help="Fleet sizes to run")
+    parser.add_argument('--events', type=int, default=50, help="VEVENTs per feed")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every fake Wyze API call")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of fake Wyze API calls that fail")
+    parser.add_argument('--rate', type=float, default=0.0, help="API_RATE_PER_SECOND for the run, 0 for no limit")
+    parser.add_argument('--backend', choices=('wyze', 'memory'), default='wyze', help="Fake Wyze client behind the API scheduler, or the in-memory backend that batches each lock's changes")
+    parser.add_argument('--homes-per-lock', type=int, default=1, help="Homes sharing each lock")
+    parser.add_argument('--churn', type=float, default=0.1, help="Share of feeds that change before the churn cycle")
+    parser.add_argument('--json', action='store_true', help="Print raw results as JSON lines")
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_scale(args.child, args)))
+        return
+
+    for homes in args.homes:
+        command = [sys.executable, __file__, '--child', str(homes), '--events', str(args.events),
+                   '--latency', str(args.latency), '--error-rate', str(args.error_rate), '--rate', str(args.rate), '--churn', str(args.churn), '--backend', args.backend,
+                   '--homes-per-lock', str(args.homes_per_lock)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results = json.loads(output.strip().splitlines()[-1])
+        if args.json:
+            print(json.dumps(results))
+        else:
+            print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#fakes.py
+# Local stand-ins used by the benchmarks: an HTTP server for synthetic Airbnb iCal feeds,
+# an in-process Wyze client with configurable latency and error rate, and an SMTP sink.
+import itertools
+import random
+import socketserver
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from wyze_sdk.errors import WyzeApiError, WyzeRequestError
+from wyze_sdk.models.devices.locks import LockKey, LockKeyType
+from wyze_sdk.service.ford_service import FordResponse
+
+
+# Roughly what Airbnb exports: a mix of reservations and blocked nights, descriptions folded at 75 octets.
+# Each revision of the same seed keeps the UIDs but cancels about 5% of the stays and moves another 5%
+def synthetic_feed(events, seed=0, start=date(2025, 1, 1), revision=0):
+    rng = random.Random(seed)
+    edits = random.Random(seed * 7919 + revision)
+    lines = ['BEGIN:VCALENDAR', 'PRODID:-//Airbnb Inc//Hosting Calendar 1.0//EN', 'CALSCALE:GREGORIAN', 'VERSION:2.0']
+    day = start
+    for i in range(events):
+        nights = rng.randint(1, 7)
+        check_in, check_out = day, day + timedelta(days=nights)
+        day = check_out
+        uid, reserved, reservation, phone = rng.getrandbits(48), rng.random() < 0.6, rng.getrandbits(40), rng.randint(0, 9999)
+        edit = edits.random() if revision else 1.0
+        if edit < 0.05:
+            continue  # cancelled
+        if edit < 0.1:
+            # guest leaves a night early, or a one night stay moves a day earlier
+            if nights > 1:
+                check_out -= timedelta(days=1)
+            else:
+                check_in, check_out = check_in - timedelta(days=1), check_out - timedelta(days=1)
+        lines.append('BEGIN:VEVENT')
+        lines.append(f'DTEND;VALUE=DATE:{check_out:%Y%m%d}')
+        lines.append(f'DTSTART;VALUE=DATE:{check_in:%Y%m%d}')
+        lines.append(f'UID:{seed:x}-{i:08x}-{uid:012x}@airbnb.com')
+        if reserved:
+            description = (f'Reservation URL: https://www.airbnb.com/hosting/reservations/details/HM{reservation:X}\\n'
+                           f'Phone Number (Last 4 Digits): {phone:04d}')
+            line = f'DESCRIPTION:{description}'
+            lines.append(line[:75])
+            lines.extend(' ' + line[j:j + 74] for j in range(75, len(line), 74))
+            lines.append('SUMMARY:Reserved')
+        else:
+            lines.append('SUMMARY:Airbnb (Not available)')
+        lines.append('END:VEVENT')
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines) + '\r\n'
+
+
+# Serves /feeds/<n>.ics with ETag support. churn() moves a share of the feeds to their next revision
+class IcalServer:
+    def __init__(self, feeds, events=50, start=None, seed=0):
+        self.feeds = feeds
+        self.events = events
+        self.start = start or date.today() - timedelta(days=3)
+        self.seed = seed
+        self.versions = [0] * feeds
+        self.bodies = {}
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.rng = random.Random(seed)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._serve(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def url(self, n):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/feeds/{n}.ics"
+
+    def body(self, n):
+        with self.lock:
+            version = self.versions[n]
+            if (n, version) not in self.bodies:
+                self.bodies[(n, version)] = synthetic_feed(self.events, seed=self.seed + n * 1000, start=self.start, revision=version).encode()
+            return version, self.bodies[(n, version)]
+
+    def churn(self, fraction):
+        changed = self.rng.sample(range(self.feeds), int(self.feeds * fraction))
+        with self.lock:
+            for n in changed:
+                self.versions[n] += 1
+        return len(changed)
+
+    def _serve(self, handler):
+        try:
+            n = int(handler.path.rsplit('/', 1)[-1].split('.')[0])
+            version, body = self.body(n)
+        except (ValueError, IndexError):
+            handler.send_error(404)
+            return
+        etag = f'"{n}-{version}"'
+        if handler.headers.get('If-None-Match') == etag:
+            self.requests['304'] += 1
+            handler.send_response(304)
+            handler.send_header('ETag', etag)
+            handler.end_headers()
+            return
+        self.requests['200'] += 1
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/calendar; charset=utf-8')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.send_header('ETag', etag)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+# Mirrors the parts of wyze_sdk's LocksClient the script uses, keeping keys in memory
+# Lock errors as the SDK's Ford service raises them: the body is in a FordResponse, not a plain dict
+def ford_error(code, msg):
+    response = FordResponse(client=None, http_verb='POST', api_url='https://yd-saas-toc.wyzecam.com/openapi/lock/v1/fake',
+                            req_args={}, data={'code': code, 'msg': msg}, headers={}, status_code=200)
+    return WyzeApiError("The request to the Wyze Ford API failed.", response)
+
+
+class FakeLocks:
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.keys = {}
+        self.ids = itertools.count(1)
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def _call(self, op):
+        with self.lock:
+            self.calls[op] += 1
+            fail = self.rng.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise ford_error(5000, 'injected failure')
+
+    def get_keys(self, *, device_mac, **kwargs):
+        self._call('get_keys')
+        with self.lock:
+            return list(self.keys.get(device_mac, {}).values())
+
+    def create_access_code(self, device_mac, access_code, name, permission=None, periodicity=None, **kwargs):
+        if not isinstance(access_code, str) or not access_code.isdigit() or not 4 <= len(access_code) <= 8:
+            raise WyzeRequestError(f"{access_code} is not a valid access code")
+        self._call('create_access_code')
+        with self.lock:
+            key_id = next(self.ids)
+            self.keys.setdefault(device_mac, {})[key_id] = LockKey(id=key_id, type=LockKeyType.ACCESS_CODE, name=name, permission=permission, periodicity=periodicity)
+
+    def update_access_code(self, device_mac, access_code_id, access_code=None, name=None, permission=None, periodicity=None, **kwargs):
+        if not isinstance(access_code, str) or not access_code.isdigit() or not 4 <= len(access_code) <= 8:
+            raise WyzeRequestError(f"{access_code} is not a valid access code")
+        if permission is None:
+            raise WyzeRequestError("permission must be provided")
+        self._call('update_access_code')
+        with self.lock:
+            key = self.keys.get(device_mac, {}).get(int(access_code_id))
+            if key is None:
+                raise ford_error(1003, 'password not found')
+            key.name = name or key.name
+            key.permission = permission or key.permission
+
+    def delete_access_code(self, device_mac, access_code_id, **kwargs):
+        self._call('delete_access_code')
+        with self.lock:
+            if self.keys.get(device_mac, {}).pop(int(access_code_id), None) is None:
+                raise ford_error(1003, 'password not found')
+
+
+class FakeClient:
+    def __init__(self, locks):
+        self.locks = locks
+
+
+# Minimal SMTP server that accepts and counts messages, no STARTTLS or AUTH
+class SmtpSink:
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                sink.connections += 1
+                self.reply('220 sink ESMTP')
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode(errors='replace').strip().upper()
+                    if command.startswith(('EHLO', 'HELO')):
+                        self.reply('250 sink')
+                    elif command == 'DATA':
+                        self.reply('354 end with <CRLF>.<CRLF>')
+                        data = []
+                        for data_line in self.rfile:
+                            if data_line in (b'.\r\n', b'.\n'):
+                                break
+                            data.append(data_line)
+                        sink.messages.append(b''.join(data))
+                        self.reply('250 queued')
+                    elif command == 'QUIT':
+                        self.reply('221 bye')
+                        return
+                    else:
+                        self.reply('250 ok')
+
+            def reply(self, text):
+                self.wfile.write(f"{text}\r\n".encode())
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,57 @@
+#booking_changes.py
+# Snapshot diffing for the calendar feeds. The state store keeps each home's last applied bookings
+# by UID together with a hash of what the access code depends on (the code and its window).
+# Each poll is compared with that snapshot, and only the bookings that were added, cancelled or
+# moved touch the lock: new codes are created, cancelled ones revoked and moved ones updated in place.
+import hashlib
+
+
+def content_hash(code, check_in, check_out):
+    text = f"{code}|{int(check_in.timestamp())}|{int(check_out.timestamp())}"
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def row_hash(row):
+    return row.get('content_hash') or content_hash(row['code'], row['check_in'], row['check_out'])
+
+
+class ChangeSet:
+    __slots__ = ('added', 'changed', 'removed', 'forget')
+
+    def __init__(self):
+        self.added = []  # (uid, code, check_in, check_out) to create, new or not set yet
+        self.changed = []  # (row, (uid, code, check_in, check_out)) provisioned codes whose window or code moved
+        self.removed = []  # provisioned rows whose booking left the feed before the stay ended
+        self.forget = []  # uids dropped without touching the lock, their code was never set
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+    def summary(self):
+        return f"{len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} cancelled"
+
+
+# Compare a poll with the snapshot ({uid: state store row}). Bookings that are over are left out on both
+# sides: a stay that drops off the feed because it ended is checkout cleanup's job, not a cancellation.
+# Without prune the codes are a subset of the feed and nothing is treated as removed
+def diff(snapshot, codes, now, prune=True):
+    changes = ChangeSet()
+    seen = set()
+    for uid, code, check_in, check_out in codes:
+        if check_out <= now:
+            continue
+        seen.add(uid)
+        row = snapshot.get(uid)
+        if row is None or not row['provisioned_at']:
+            changes.added.append((uid, code, check_in, check_out))
+        elif row_hash(row) != content_hash(code, check_in, check_out):
+            changes.changed.append((row, (uid, code, check_in, check_out)))
+    if prune:
+        for uid, row in snapshot.items():
+            if uid in seen:
+                continue
+            if not row['provisioned_at']:
+                changes.forget.append(uid)
+            elif row['check_out'] > now:
+                changes.removed.append(row)
+    return changes
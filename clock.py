@@ -0,0 +1,44 @@
+#clock.py
+# Time source for everything that schedules bookings or compares them with "now". It is the system
+# clock unless --replay switches to a VirtualClock, which only moves when the replay advances it,
+# so a month of check-ins and check-outs runs in seconds.
+import time as _time
+from datetime import datetime, timezone
+
+
+class VirtualClock:
+    def __init__(self, start):
+        self.current = float(start)
+
+    def time(self):
+        return self.current
+
+    def advance_to(self, when):
+        self.current = max(self.current, float(when))
+
+
+_virtual = None
+
+
+def use_virtual(start):
+    global _virtual
+    _virtual = VirtualClock(start)
+    return _virtual
+
+
+def time():
+    return _virtual.time() if _virtual is not None else _time.time()
+
+
+# For TTLs and intervals, follows the virtual clock during a replay
+def monotonic():
+    return _virtual.time() if _virtual is not None else _time.monotonic()
+
+
+# Aware datetime in tz, naive local time without one, like datetime.now()
+def now(tz=None):
+    return datetime.fromtimestamp(time(), tz)
+
+
+def now_utc():
+    return now(timezone.utc)
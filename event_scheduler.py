@@ -0,0 +1,117 @@
+#event_scheduler.py
+# Priority-queue scheduler for the daemon. Instead of waking every second to poll,
+# it sleeps until the next due event (feed refresh, code activation, checkout cleanup)
+# and can be woken early with wake(), e.g. from a signal handler.
+import heapq
+import itertools
+from collections import deque
+import threading
+import time
+from datetime import datetime
+
+
+def _timestamp(when):
+    return when.timestamp() if isinstance(when, datetime) else float(when)
+
+
+class EventScheduler:
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.heap = []
+        self.events = {}
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.triggered = deque()
+        self.stopped = False
+
+    # Schedule fn(*args) at `when` (datetime or epoch seconds). Scheduling again with the same key
+    # replaces the earlier event
+    def schedule(self, when, key, fn, *args):
+        due = _timestamp(when)
+        with self.lock:
+            entry = [due, next(self.counter), key, fn, args]
+            if key in self.events:
+                self.events[key][3] = None  # superseded, dropped when popped
+            self.events[key] = entry
+            heapq.heappush(self.heap, entry)
+        self.wakeup.set()
+
+    def cancel(self, key):
+        with self.lock:
+            entry = self.events.pop(key, None)
+            if entry is not None:
+                entry[3] = None
+
+    def next_due(self):
+        with self.lock:
+            while self.heap and self.heap[0][3] is None:
+                heapq.heappop(self.heap)
+            return self.heap[0][0] if self.heap else None
+
+    # Run the event with this key as soon as possible. Only appends and sets an Event, so it is
+    # safe to call from a signal handler
+    def trigger(self, key):
+        self.triggered.append(key)
+        self.wakeup.set()
+
+    def _run_triggered(self):
+        while self.triggered:
+            key = self.triggered.popleft()
+            with self.lock:
+                entry = self.events.get(key)
+            if entry is not None:
+                self.schedule(self.clock(), key, entry[3], *entry[4])
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+    # Run every event that is due, returns how many ran
+    def run_pending(self):
+        self._run_triggered()
+        ran = 0
+        while True:
+            with self.lock:
+                while self.heap and self.heap[0][3] is None:
+                    heapq.heappop(self.heap)
+                if not self.heap or self.heap[0][0] > self.clock():
+                    return ran
+                due, seq, key, fn, args = heapq.heappop(self.heap)
+                if key in self.events and self.events[key][1] == seq:
+                    del self.events[key]
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Scheduled job {key} failed: {e}")
+            ran += 1
+
+    # Run every event due up to `until` without sleeping, moving a virtual clock to each event's time
+    # with advance_to(when). Used by --replay to simulate days in seconds
+    def run_until(self, until, advance_to):
+        until = _timestamp(until)
+        while not self.stopped:
+            self._run_triggered()
+            due = self.next_due()
+            if due is None or due > until:
+                break
+            advance_to(due)
+            self.run_pending()
+        advance_to(until)
+
+    # Seconds until the next event, None when nothing is scheduled
+    def idle_time(self):
+        due = self.next_due()
+        return None if due is None else max(due - self.clock(), 0)
+
+    def run_forever(self):
+        while not self.stopped:
+            self.run_pending()
+            self.wakeup.clear()
+            if self.stopped:
+                return
+            if self.triggered:
+                continue
+            timeout = self.idle_time()
+            if timeout is None or timeout > 0:
+                self.wakeup.wait(timeout)
@@ -0,0 +1,319 @@
+#feed_cache.py
+# Shared HTTP connection pool and persistent cache for the Airbnb iCal feeds.
+# Every feed is fetched with If-None-Match / If-Modified-Since so an unchanged
+# calendar costs one small round trip, and the parsed bookings are reused when
+# the server answers 304 or sends back the exact same body. Fetches only change the cache in
+# memory; the caller writes it to disk once per sync cycle with flush().
+# A feed gets FEED_DEADLINE seconds in total, on top of connect and read timeouts. A feed that keeps
+# failing trips a circuit breaker and is left alone for a while. While a feed fails, the last good
+# bookings are used for up to FEED_STALE_MAX_HOURS, so one down listing never holds up the others.
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import date, datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+
+import clock
+import metrics
+
+FEED_CACHE_PATH = os.getenv('FEED_CACHE_PATH', '.feed_cache.json')
+ICAL_POOL_SIZE = int(os.getenv('ICAL_POOL_SIZE', '10'))
+# Seconds to connect, to wait for each read, and for the whole download
+FEED_CONNECT_TIMEOUT = float(os.getenv('FEED_CONNECT_TIMEOUT', '5'))
+FEED_READ_TIMEOUT = float(os.getenv('FEED_READ_TIMEOUT', '20'))
+FEED_DEADLINE = float(os.getenv('FEED_DEADLINE', '60'))
+# Failures in a row before a feed is skipped, for FEED_BREAKER_COOLDOWN seconds doubling up to the max
+FEED_BREAKER_THRESHOLD = int(os.getenv('FEED_BREAKER_THRESHOLD', '3'))
+FEED_BREAKER_COOLDOWN = float(os.getenv('FEED_BREAKER_COOLDOWN', '300'))
+FEED_BREAKER_MAX_COOLDOWN = float(os.getenv('FEED_BREAKER_MAX_COOLDOWN', '3600'))
+# How old the last good bookings may be and still stand in for a failed feed
+FEED_STALE_MAX_HOURS = float(os.getenv('FEED_STALE_MAX_HOURS', '24'))
+# Confirmations that a cached feed is still current are written to disk at most this often
+TOUCH_SAVE_SECONDS = 600
+# Bump when the shape of the parsed bookings changes so old cache entries are re-parsed
+CACHE_VERSION = 2
+
+_session = None
+_session_lock = threading.Lock()
+
+
+# One pooled session for all feeds so TLS connections to Airbnb are reused
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=ICAL_POOL_SIZE, pool_maxsize=ICAL_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+    return _session
+
+
+# Bookings hold date/datetime values, tag them so they survive the JSON round trip
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _decode(obj):
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    if '__date__' in obj:
+        return date.fromisoformat(obj['__date__'])
+    return obj
+
+
+class FeedCache:
+    def __init__(self, path=FEED_CACHE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = self._load()
+        self.saved_at = None
+        self.dirty = False  # bookings changed since the last save
+        self.touched = False  # only checked_at changed since the last save
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f, object_hook=_decode)
+            return {url: entry for url, entry in entries.items() if entry.get('version') == CACHE_VERSION}
+        except FileNotFoundError:
+            return {}
+        except (ValueError, OSError) as e:
+            print(f"Ignoring unreadable feed cache {self.path}: {e}")
+            return {}
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(self.entries, default=_encode)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+            self.saved_at = clock.monotonic()
+            self.dirty = self.touched = False
+
+    # Write the cache if bookings changed, or if feeds were only confirmed current and the last
+    # write is TOUCH_SAVE_SECONDS old, so a restart keeps most of that freshness
+    def flush(self):
+        with self.lock:
+            due = self.dirty or (self.touched and (self.saved_at is None or clock.monotonic() - self.saved_at >= TOUCH_SAVE_SECONDS))
+        if due:
+            self.save()
+
+    def get(self, url):
+        with self.lock:
+            return self.entries.get(url)
+
+    def conditional_headers(self, url):
+        entry = self.get(url)
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url, etag, last_modified, body_hash, bookings):
+        with self.lock:
+            self.entries[url] = {
+                'version': CACHE_VERSION,
+                'etag': etag,
+                'last_modified': last_modified,
+                'body_hash': body_hash,
+                'fetched_at': clock.time(),
+                'checked_at': clock.time(),
+                'bookings': bookings,
+            }
+            self.dirty = True
+
+    # The server confirmed the cached body is current (a 304 or the same body again), the bookings are
+    # as fresh as this check
+    def touch(self, url):
+        with self.lock:
+            if url in self.entries:
+                self.entries[url]['checked_at'] = clock.time()
+                self.touched = True
+
+    # Seconds since the server last confirmed the cached bookings, None without an entry
+    def age(self, url):
+        entry = self.get(url)
+        if entry is None:
+            return None
+        return clock.time() - entry.get('checked_at', entry['fetched_at'])
+
+    def invalidate(self, url):
+        with self.lock:
+            self.entries.pop(url, None)
+
+
+class FeedTimeout(requests.Timeout):
+    pass
+
+
+# Raised when a feed failed and there are no recent enough bookings to fall back on
+class FeedUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=FEED_BREAKER_THRESHOLD, cooldown=FEED_BREAKER_COOLDOWN, max_cooldown=FEED_BREAKER_MAX_COOLDOWN, clock=clock.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.failures = {}  # url -> failures in a row
+        self.open_until = {}
+
+    # False while the breaker is open. Once the cooldown is over one attempt goes through,
+    # a failure opens it again for twice as long
+    def allow(self, url):
+        with self.lock:
+            return self.clock() >= self.open_until.get(url, 0)
+
+    def record_success(self, url):
+        with self.lock:
+            self.failures.pop(url, None)
+            self.open_until.pop(url, None)
+
+    # Returns the seconds the breaker opened for, 0 while it stays closed
+    def record_failure(self, url):
+        with self.lock:
+            failures = self.failures[url] = self.failures.get(url, 0) + 1
+            if failures < self.threshold:
+                return 0
+            cooldown = min(self.cooldown * 2 ** (failures - self.threshold), self.max_cooldown)
+            self.open_until[url] = self.clock() + cooldown
+            return cooldown
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_breaker = None
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = FeedCache()
+    return _cache
+
+
+# Swap in another cache, e.g. a throwaway one for --replay
+def use_cache(cache):
+    global _cache
+    with _cache_lock:
+        _cache = cache
+
+
+def get_breaker():
+    global _breaker
+    with _cache_lock:
+        if _breaker is None:
+            _breaker = CircuitBreaker()
+    return _breaker
+
+
+# Body chunks as they arrive. iter_content() blocks until a whole chunk is read, which a feed
+# trickling in a few bytes at a time could drag out well past the deadline
+def _chunks(response):
+    read1 = getattr(response.raw, 'read1', None)
+    if read1 is None or response._content_consumed:  # urllib3 1.x, or a body already read (--record)
+        yield from response.iter_content(8 * 1024)
+        return
+    while True:
+        try:
+            chunk = read1(64 * 1024, decode_content=True)
+        except ReadTimeoutError as e:
+            raise FeedTimeout(str(e)) from e
+        if not chunk:
+            return
+        yield chunk
+
+
+# Download a feed within the deadline. Returns (response, body), body is None for anything but a 200
+def _download(url, headers):
+    deadline = time.monotonic() + FEED_DEADLINE
+    response = get_session().get(url, headers=headers, timeout=(FEED_CONNECT_TIMEOUT, FEED_READ_TIMEOUT), stream=True)
+    try:
+        if response.status_code != 200:
+            return response, None
+        chunks = []
+        for chunk in _chunks(response):
+            chunks.append(chunk)
+            if time.monotonic() > deadline:
+                raise FeedTimeout(f"Feed download took longer than {FEED_DEADLINE:g}s")
+        return response, b''.join(chunks)
+    finally:
+        response.close()
+
+
+# Fetch a feed and return its parsed bookings, only calling parse() when the body changed.
+# When the feed fails, times out or its breaker is open, the cached bookings are returned if they
+# are recent enough, FeedUnavailable is raised otherwise.
+# home only labels the metrics, feed URLs carry a secret and are never recorded
+def fetch_bookings(url, parse, home=None):
+    breaker = get_breaker()
+    if not breaker.allow(url):
+        return _fall_back(url, home, 'circuit_open', "feed skipped after repeated failures")
+    try:
+        bookings = _fetch_bookings(url, parse, home)
+    except Exception as e:
+        cooldown = breaker.record_failure(url)
+        if cooldown:
+            print(f"Feed for {home or 'a home'} keeps failing, skipping it for {cooldown:g}s")
+        reason = 'timeout' if isinstance(e, requests.Timeout) else 'error'
+        return _fall_back(url, home, reason, e)
+    breaker.record_success(url)
+    return bookings
+
+
+def _fall_back(url, home, reason, error):
+    cache = get_cache()
+    age = cache.age(url)
+    if age is None or age > FEED_STALE_MAX_HOURS * 3600:
+        raise FeedUnavailable(f"{error}, and no cached bookings from the last {FEED_STALE_MAX_HOURS:g} hours")
+    metrics.get_metrics().inc('feed_stale_total', home=home, reason=reason)
+    print(f"Using cached bookings for {home or 'a home'} from {age / 60:.0f} minutes ago: {error}")
+    return [dict(booking) for booking in cache.get(url)['bookings']]
+
+
+def _fetch_bookings(url, parse, home=None):
+    cache = get_cache()
+    entry = cache.get(url)
+    with metrics.timed('fetch', home=home):
+        response, body = _download(url, cache.conditional_headers(url))
+    metrics.get_metrics().inc('feed_responses_total', home=home, status=response.status_code)
+
+    if response.status_code == 304 and entry is not None:
+        cache.touch(url)
+        return [dict(booking) for booking in entry['bookings']]
+    response.raise_for_status()
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    body_hash = hashlib.sha256(body).hexdigest()
+    if entry is not None and entry['body_hash'] == body_hash:
+        bookings = entry['bookings']
+        if etag != entry.get('etag') or last_modified != entry.get('last_modified'):
+            cache.store(url, etag, last_modified, body_hash, bookings)
+        else:
+            cache.touch(url)
+        return [dict(booking) for booking in bookings]
+
+    with metrics.timed('parse', home=home):
+        bookings = parse(body.decode(response.encoding or 'utf-8', errors='replace'))
+    cache.store(url, etag, last_modified, body_hash, bookings)
+    return [dict(booking) for booking in bookings]
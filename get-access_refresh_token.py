@@ -1,9 +1,8 @@
 import os
 import pyotp
 import argparse
-import schedule
 import time
-from dotenv import load_dotenv, set_key
+from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from wyze_sdk import Client
 from wyze_sdk.errors import WyzeApiError
@@ -11,15 +10,14 @@ from wyze_sdk.errors import WyzeApiError
 # Load environment variables from .env file
 load_dotenv()
 
+import token_manager
+
 # Constants
 WYZE_EMAIL = os.getenv('WYZE_EMAIL')
 WYZE_PASSWORD = os.getenv('WYZE_PASSWORD')
 WYZE_API_KEY = os.getenv('WYZE_API_KEY')
 WYZE_KEY_ID = os.getenv('WYZE_KEY_ID')
 WYZE_TOTP_KEY = os.getenv('WYZE_TOTP_KEY')
-WYZE_ACCESS_TOKEN = os.getenv('WYZE_ACCESS_TOKEN')
-WYZE_REFRESH_TOKEN = os.getenv('WYZE_REFRESH_TOKEN')
-ENV_FILE_PATH = '.env'
 
 # Check if all necessary environment variables are set
 def check_env_variables(required_vars):
@@ -46,51 +44,30 @@ def authenticate_with_sdk(email, password, key_id=None, api_key=None, totp_key=N
         print(f"Authentication failed: {e}")
         raise
 
-def refresh_access_token(refresh_token):
-    client = Client(refresh_token=refresh_token)
+def refresh_access_token():
+    tokens = token_manager.get_token_manager()
     try:
-        response = client.refresh_token()
-        new_access_token = response['access_token']
-        new_refresh_token = response['refresh_token']
-        update_env_file(new_access_token, new_refresh_token)
-        return new_access_token, new_refresh_token
+        # treat the saved token as rejected so it is always refreshed
+        return tokens.refresh(failed_token=tokens.access_token)
     except WyzeApiError as e:
         print(f"Failed to refresh access token: {e}")
         raise
 
+# Saved atomically under a file lock so a running wyze-lock-airbnb.py picks the tokens up
 def update_env_file(access_token, refresh_token):
-    set_key(ENV_FILE_PATH, 'WYZE_ACCESS_TOKEN', access_token)
-    set_key(ENV_FILE_PATH, 'WYZE_REFRESH_TOKEN', refresh_token)
-    print("Access and refresh tokens have been saved to the .env file.")
-    # exit function after this point to avoid infinite loop
-    exit()
-
-def get_client():
-    global WYZE_ACCESS_TOKEN, WYZE_REFRESH_TOKEN
-    try:
-        client = Client(token=WYZE_ACCESS_TOKEN)
-        # Test if the access token is valid
-        client.devices_list()
-    except WyzeApiError as e:
-        if "AccessTokenError" in str(e) or "access token expired" in str(e):
-            print("Access token expired, refreshing...")
-            try:
-                WYZE_ACCESS_TOKEN, WYZE_REFRESH_TOKEN = refresh_access_token(WYZE_REFRESH_TOKEN)
-                os.environ['WYZE_ACCESS_TOKEN'] = WYZE_ACCESS_TOKEN
-                os.environ['WYZE_REFRESH_TOKEN'] = WYZE_REFRESH_TOKEN
-                client = Client(token=WYZE_ACCESS_TOKEN)
-            except Exception as refresh_error:
-                print(f"Failed to refresh access token: {refresh_error}")
-                raise e  # Re-raise the original error if refreshing fails
-        else:
-            raise e  # Re-raise the original error if it's not an access token issue
-    return client
+    token_manager.get_token_manager().save(access_token, refresh_token)
 
 def main():
     parser = argparse.ArgumentParser(description="Wyze Token Retriever")
     parser.add_argument('--mfa', action='store_true', help="Use MFA for authentication")
+    parser.add_argument('--refresh', action='store_true', help="Refresh the saved access token instead of logging in")
+    parser.add_argument('--keep-refreshing', action='store_true', help="Keep running and refresh the access token before it expires")
     args = parser.parse_args()
 
+    if args.refresh:
+        refresh_access_token()
+        return
+
     required_vars = ['WYZE_EMAIL', 'WYZE_PASSWORD']
     if args.mfa:
         required_vars.append('WYZE_TOTP_KEY')
@@ -106,13 +83,11 @@ def main():
         
         update_env_file(access_token, refresh_token)
 
-        # Schedule token refresh every 30 minutes
-        schedule.every(30).minutes.do(refresh_access_token, refresh_token=refresh_token)
-
-        # Main loop to keep the script running
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
+        if args.keep_refreshing:
+            # Refreshes shortly before the access token expires, shared with any other process using the .env file
+            token_manager.get_token_manager().start_background_refresh()
+            while True:
+                time.sleep(3600)
     except WyzeApiError as err:
         print(f"API error occurred: {err}")
     except Exception as err:
@@ -0,0 +1,183 @@
+#home_config.py
+# The homes to manage, as typed records parsed and validated once. They come from a TOML file
+# (HOME_CONFIG_PATH, homes.toml by default, YAML when the file ends in .yaml/.yml and PyYAML is
+# installed) and fall back to the numbered HOME_<n>_* environment variables when there is no file.
+# The daemon polls the file with a ConfigWatcher and applies only the homes that changed.
+import hashlib
+import os
+import re
+from dataclasses import dataclass
+from datetime import time
+
+import pytz
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+HOME_CONFIG_PATH = os.getenv('HOME_CONFIG_PATH', 'homes.toml')
+# How often the daemon checks the config file for changes
+CONFIG_POLL_SECONDS = int(os.getenv('CONFIG_POLL_SECONDS', '30'))
+
+REQUIRED = ('name', 'ical_url', 'lock_device_mac', 'check_in_time', 'check_out_time')
+
+
+class ConfigError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Home:
+    __slots__ = ('name', 'ical_url', 'lock_device_mac', 'check_in_time', 'check_out_time', 'timezone', 'keypad_serial_number')
+    name: str
+    ical_url: str
+    lock_device_mac: str
+    check_in_time: time
+    check_out_time: time
+    timezone: str  # None for the machine's local zone
+    keypad_serial_number: str
+
+
+def parse_time(value):
+    if isinstance(value, time):
+        return value
+    match = re.fullmatch(r'(\d{1,2}):(\d{2})', str(value).strip())
+    if not match or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise ConfigError(f"{value!r} is not a time like 16:00")
+    return time(int(match.group(1)), int(match.group(2)))
+
+
+# A Home from a mapping of its settings, the times given as "HH:MM"
+def make_home(values):
+    missing = [key for key in REQUIRED if not values.get(key)]
+    if missing:
+        raise ConfigError(f"missing {', '.join(missing)}")
+    timezone = values.get('timezone') or None
+    if timezone:
+        try:
+            pytz.timezone(timezone)
+        except pytz.UnknownTimeZoneError:
+            raise ConfigError(f"unknown timezone {timezone!r}") from None
+    return Home(
+        str(values['name']),
+        str(values['ical_url']),
+        str(values['lock_device_mac']),
+        parse_time(values['check_in_time']),
+        parse_time(values['check_out_time']),
+        timezone,
+        str(values['keypad_serial_number']) if values.get('keypad_serial_number') else None,
+    )
+
+
+# Homes from a parsed file: [defaults] applies to every [[homes]] entry unless the entry overrides it.
+# Every problem is reported at once, and a file with any problem is rejected as a whole
+def parse_config(data):
+    defaults = dict(data.get('defaults') or {})
+    defaults.setdefault('timezone', os.getenv('TIMEZONE'))
+    entries = data.get('homes') or []
+    if not isinstance(entries, list):
+        raise ConfigError("'homes' must be a list of tables")
+    homes = []
+    errors = []
+    for n, entry in enumerate(entries, 1):
+        try:
+            homes.append(make_home({**defaults, **entry}))
+        except ConfigError as e:
+            errors.append(f"home {n} ({entry.get('name') or 'unnamed'}): {e}")
+    names = [home.name for home in homes]
+    errors.extend(f"home name {name!r} is used more than once" for name in sorted({name for name in names if names.count(name) > 1}))
+    if errors:
+        raise ConfigError('; '.join(errors))
+    return homes
+
+
+def parse_text(text, path=HOME_CONFIG_PATH):
+    if path.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ConfigError(f"PyYAML is needed to read {path}, install it or use TOML") from None
+        try:
+            data = yaml.safe_load(text) or {}
+        except yaml.YAMLError as e:
+            raise ConfigError(str(e)) from None
+    else:
+        try:
+            data = tomllib.loads(text)
+        except tomllib.TOMLDecodeError as e:
+            raise ConfigError(str(e)) from None
+    if not isinstance(data, dict):
+        raise ConfigError(f"{path} must hold a mapping with a 'homes' list")
+    return parse_config(data)
+
+
+# Homes from the numbered HOME_<n>_* variables, any number of them can be defined.
+# These are only read at startup, so an incomplete home is skipped and the others still run
+def load_env_homes():
+    numbers = sorted(int(m.group(1)) for m in (re.match(r'HOME_(\d+)_ICAL_URL$', key) for key in os.environ) if m)
+    homes = []
+    for n in numbers:
+        try:
+            homes.append(make_home({
+                'name': os.getenv(f'HOME_{n}_NAME') or f'Home {n}',
+                'ical_url': os.getenv(f'HOME_{n}_ICAL_URL'),
+                'lock_device_mac': os.getenv(f'HOME_{n}_LOCK_DEVICE_MAC'),
+                'check_in_time': os.getenv(f'HOME_{n}_CHECK_IN_TIME'),
+                'check_out_time': os.getenv(f'HOME_{n}_CHECK_OUT_TIME'),
+                'timezone': os.getenv(f'HOME_{n}_TIMEZONE') or os.getenv('TIMEZONE'),
+                'keypad_serial_number': os.getenv(f'HOME_{n}_KEYPAD_SERIAL_NUMBER'),
+            }))
+        except ConfigError as e:
+            print(f"Skipping HOME_{n}: {e}")
+    return homes
+
+
+def uses_file(path=HOME_CONFIG_PATH):
+    return os.path.exists(path)
+
+
+def load_homes(path=HOME_CONFIG_PATH):
+    if uses_file(path):
+        with open(path) as f:
+            return parse_text(f.read(), path)
+    return load_env_homes()
+
+
+# Notices edits to the config file. poll() returns the new homes when the content changed,
+# None otherwise, and raises ConfigError for a file that does not validate
+class ConfigWatcher:
+    def __init__(self, path=HOME_CONFIG_PATH):
+        self.path = path
+        self.stamp = self._stat()
+        self.digest = self._digest()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _digest(self, text=None):
+        if text is None:
+            try:
+                with open(self.path) as f:
+                    text = f.read()
+            except FileNotFoundError:
+                return None
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def poll(self):
+        stamp = self._stat()
+        if stamp is None or stamp == self.stamp:
+            return None
+        self.stamp = stamp
+        with open(self.path) as f:
+            text = f.read()
+        digest = self._digest(text)
+        if digest == self.digest:
+            return None
+        homes = parse_text(text, self.path)
+        self.digest = digest
+        return homes
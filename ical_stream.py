@@ -0,0 +1,128 @@
+#ical_stream.py
+# Streaming parser for Airbnb iCal feeds. Reads the feed line by line, keeps only the
+# SUMMARY/DTSTART/DTEND/DESCRIPTION/UID of each VEVENT as raw strings and drops events
+# that are not reservations or fall outside the requested window before touching their
+# description. Produces the same booking dicts as the icalendar based parser.
+import re
+from datetime import date, datetime, timezone
+from zoneinfo import ZoneInfo
+
+WANTED = frozenset(('SUMMARY', 'DTSTART', 'DTEND', 'DESCRIPTION', 'UID'))
+PHONE_PATTERN = re.compile(r'Phone Number \(Last 4 Digits\): (\d{4})')
+ESCAPES = re.compile(r'\\([\\;,nN])')
+
+
+# Join folded lines back into logical content lines (RFC 5545 3.1)
+def unfold(lines):
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t'):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def _split(line):
+    colon = line.find(':')
+    if colon == -1:
+        return None, None, None
+    head = line[:colon]
+    # a quoted parameter value may itself contain ':'
+    if '"' in head:
+        in_quotes = False
+        for i, char in enumerate(line):
+            if char == '"':
+                in_quotes = not in_quotes
+            elif char == ':' and not in_quotes:
+                colon = i
+                break
+        head = line[:colon]
+    name, _, params = head.partition(';')
+    return name.upper(), params, line[colon + 1:]
+
+
+def _unescape(value):
+    return ESCAPES.sub(lambda m: '\n' if m.group(1) in 'nN' else m.group(1), value)
+
+
+def _parse_date(params, value):
+    value = value.strip()
+    if len(value) == 8:
+        return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+    parsed = datetime(int(value[0:4]), int(value[4:6]), int(value[6:8]),
+                      int(value[9:11]), int(value[11:13]), int(value[13:15]))
+    if value.endswith('Z'):
+        return parsed.replace(tzinfo=timezone.utc)
+    for param in params.split(';'):
+        key, _, tzid = param.partition('=')
+        if key.upper() == 'TZID':
+            return parsed.replace(tzinfo=ZoneInfo(tzid.strip('"')))
+    return parsed
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+# Yield the wanted properties of each VEVENT as {name: (params, raw_value)}.
+# Once an event's SUMMARY shows it is not a reservation the rest of it is skipped
+def iter_events(lines):
+    event = None
+    skipping = False
+    for line in unfold(lines):
+        if event is None:
+            if line == 'BEGIN:VEVENT':
+                event = {}
+                skipping = False
+            continue
+        if line == 'END:VEVENT':
+            if not skipping:
+                yield event
+            event = None
+            continue
+        if skipping:
+            continue
+        name, params, value = _split(line)
+        if name in WANTED and name not in event:
+            if name == 'SUMMARY' and 'Reserved' not in value:
+                skipping = True
+                continue
+            event[name] = (params, value)
+
+
+# Parse bookings from an iterable of lines (a file, response.iter_lines() or text.splitlines()).
+# With start/end only stays overlapping that window are returned
+def parse_bookings(lines, start=None, end=None):
+    start = _as_date(start) if start is not None else None
+    end = _as_date(end) if end is not None else None
+    bookings = []
+    for event in iter_events(lines):
+        if 'SUMMARY' not in event or 'DTSTART' not in event or 'DTEND' not in event or 'DESCRIPTION' not in event:
+            continue
+        check_in = _parse_date(*event['DTSTART'])
+        check_out = _parse_date(*event['DTEND'])
+        if start is not None and _as_date(check_out) < start:
+            continue
+        if end is not None and _as_date(check_in) > end:
+            continue
+        phone_match = PHONE_PATTERN.search(_unescape(event['DESCRIPTION'][1]))
+        if not phone_match:
+            continue
+        phone_last4 = phone_match.group(1)
+        days_stay = (check_out - check_in).days
+        guest_name = f"{check_in.strftime('%a')}-{days_stay}days"
+        uid = _unescape(event['UID'][1]) if 'UID' in event else None
+        bookings.append({
+            'uid': uid if uid else f"{check_in.isoformat()}-{phone_last4}",
+            'check_in': check_in,
+            'check_out': check_out,
+            'guest_phone_last4': phone_last4,
+            'guest_name': guest_name
+        })
+    return bookings
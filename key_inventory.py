@@ -0,0 +1,75 @@
+#key_inventory.py
+# Per-lock cache of the keys returned by client.locks.get_keys, kept for KEY_CACHE_TTL seconds
+# and updated locally after each create/update/delete, so a sync cycle reads each lock at most once.
+import os
+import threading
+
+import clock
+
+KEY_CACHE_TTL = int(os.getenv('KEY_CACHE_TTL', '300'))
+
+
+class KeyInventory:
+    def __init__(self, ttl=KEY_CACHE_TTL, clock=clock.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Keys for a lock, calling fetch() only when the cached copy is missing or older than the TTL.
+    # With require_ids, a cached copy holding keys created since the last read (id unknown) is refetched
+    def get(self, device_mac, fetch, require_ids=False):
+        with self.lock:
+            entry = self.entries.get(device_mac)
+            if entry is not None and self.clock() - entry[0] < self.ttl:
+                if not require_ids or all(key.id is not None for key in entry[1]):
+                    self.hits += 1
+                    return list(entry[1])
+            self.misses += 1
+        keys = list(fetch())
+        with self.lock:
+            self.entries[device_mac] = (self.clock(), keys)
+        return list(keys)
+
+    def invalidate(self, device_mac=None):
+        with self.lock:
+            if device_mac is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(device_mac, None)
+
+    def record_created(self, device_mac, key):
+        with self.lock:
+            if device_mac in self.entries:
+                self.entries[device_mac][1].append(key)
+
+    def record_updated(self, device_mac, key):
+        with self.lock:
+            if device_mac in self.entries:
+                keys = self.entries[device_mac][1]
+                keys[:] = [existing for existing in keys if str(existing.id) != str(key.id)] + [key]
+
+    def record_deleted(self, device_mac, key_id):
+        with self.lock:
+            if device_mac in self.entries:
+                keys = self.entries[device_mac][1]
+                keys[:] = [key for key in keys if str(key.id) != str(key_id)]
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+
+_inventory = None
+_inventory_lock = threading.Lock()
+
+
+def get_inventory():
+    global _inventory
+    with _inventory_lock:
+        if _inventory is None:
+            _inventory = KeyInventory()
+    return _inventory
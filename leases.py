@@ -0,0 +1,159 @@
+#leases.py
+# Per-home leases in the state database so exactly one process provisions a home at a time,
+# whether that is one of the sharded daemon workers, a second copy of the daemon or a CLI run.
+# Homes are hash-partitioned across the workers. A worker keeps renewing the leases of its own
+# homes; a home whose lease expired (its worker crashed or hung) is borrowed by whichever worker
+# syncs next and released again afterwards, so the home's own worker gets it back once it returns.
+# Released leases are kept with expires_at 0, which tells them apart from expired ones.
+import os
+import socket
+import sqlite3
+import threading
+import zlib
+
+import clock
+
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'wyze_state.db')
+# Seconds a lease stays valid without renewal, renewed every third of that
+LEASE_TTL = int(os.getenv('LEASE_TTL', '60'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    home TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+# Stable across processes and runs, unlike hash()
+def shard_of(home, count):
+    return zlib.crc32(home.encode()) % count
+
+
+class LeaseManager:
+    def __init__(self, path=STATE_DB_PATH, ttl=LEASE_TTL, owner=None, clock=clock.time):
+        self.ttl = ttl
+        self.clock = clock
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.shard = (0, 1)
+        self.keep = False  # only a daemon with a renewal thread keeps its own homes between syncs
+        self.held = set()
+        self.started = clock()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+        self._stop = threading.Event()
+        self._renewer = None
+        self.watched = []  # homes whose expired leases start_renewal reports
+
+    def set_shard(self, index, count):
+        self.shard = (index, count)
+
+    def is_own(self, home):
+        index, count = self.shard
+        return shard_of(home, count) == index
+
+    # Take or extend the lease on each home that is free, expired or already ours, returns the homes held.
+    # Another worker's home that was never leased is left to that worker for the first TTL after startup
+    def claim(self, homes):
+        now = self.clock()
+        settled = now - self.started >= self.ttl
+        with self.lock, self.conn:
+            for home in homes:
+                if not settled and not self.is_own(home):
+                    if self.conn.execute("SELECT 1 FROM leases WHERE home = ?", (home,)).fetchone() is None:
+                        continue
+                cursor = self.conn.execute(
+                    """
+                    INSERT INTO leases (home, owner, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT (home) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                    WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+                    """,
+                    (home, self.owner, now + self.ttl, now),
+                )
+                if cursor.rowcount:
+                    self.held.add(home)
+                else:
+                    self.held.discard(home)
+            return {home for home in homes if home in self.held}
+
+    def holds(self, home):
+        with self.lock:
+            return home in self.held
+
+    # Give back leases that are not ours to keep: other workers' homes, or everything outside the daemon
+    def release_borrowed(self, homes):
+        self.release([home for home in homes if not (self.keep and self.is_own(home))])
+
+    def release(self, homes):
+        with self.lock, self.conn:
+            for home in homes:
+                self.conn.execute("UPDATE leases SET expires_at = 0 WHERE home = ? AND owner = ?", (home, self.owner))
+                self.held.discard(home)
+
+    def release_all(self):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE leases SET expires_at = 0 WHERE owner = ?", (self.owner,))
+            self.held.clear()
+
+    # Extend every lease still held, dropping the ones another process took over in the meantime
+    def renew(self):
+        now = self.clock()
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE leases SET expires_at = ? WHERE owner = ? AND expires_at >= ?", (now + self.ttl, self.owner, now))
+            self.held = {row[0] for row in self.conn.execute("SELECT home FROM leases WHERE owner = ? AND expires_at >= ?", (self.owner, now))}
+
+    # Homes among these whose lease ran out without being released, i.e. their worker is gone
+    def orphaned(self, homes):
+        now = self.clock()
+        with self.lock:
+            expired = {row[0] for row in self.conn.execute("SELECT home FROM leases WHERE expires_at > 0 AND expires_at < ?", (now,))}
+        return [home for home in homes if home in expired]
+
+    # Keep own homes leased from a background thread. on_orphaned(homes) is called when leases of
+    # other workers expire, so the daemon can sync those homes without waiting for its next cycle
+    def start_renewal(self, homes=(), on_orphaned=None):
+        self.keep = True
+        self.watch(homes)
+        if self._renewer is not None and self._renewer.is_alive():
+            return
+        self._stop.clear()
+        self._renewer = threading.Thread(target=self._renew_loop, args=(on_orphaned,), name="lease-renewal", daemon=True)
+        self._renewer.start()
+
+    # Replace the homes checked for expired leases, e.g. after the home config changed
+    def watch(self, homes):
+        self.watched = list(homes)
+
+    def stop(self):
+        self._stop.set()
+
+    def _renew_loop(self, on_orphaned):
+        while not self._stop.wait(max(self.ttl / 3, 1)):
+            try:
+                self.renew()
+                orphaned = self.orphaned(self.watched)
+                if orphaned and on_orphaned is not None:
+                    on_orphaned(orphaned)
+            except sqlite3.Error as e:
+                print(f"Failed to renew home leases: {e}")
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_lease_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = LeaseManager()
+    return _manager
+
+
+def use_lease_manager(manager):
+    global _manager
+    with _manager_lock:
+        _manager = manager
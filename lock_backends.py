@@ -0,0 +1,236 @@
+#lock_backends.py
+# The locks the sync engine talks to. A backend lists a lock's keys and applies a batch of
+# creates, updates or deletes to one lock. A backend that sets supports_bulk sends each batch
+# as a single request; the others apply it one code at a time, which is all the Wyze API offers.
+# WyzeLockBackend is the real thing, InMemoryLockBackend keeps keys in memory for --replay,
+# the benchmarks and trying out changes without a lock.
+import itertools
+import re
+import threading
+import time
+from collections import Counter, namedtuple
+from types import SimpleNamespace
+
+import clock
+import metrics
+
+# What the engine asks a lock to hold: a code, the key's name and its validity window
+AccessCode = namedtuple('AccessCode', 'code name begin end')
+# Result of one item of a batch: key_id is the key created, updated or deleted (None when the lock
+# does not report a new key's id), error is the exception the item failed with, None on success
+Outcome = namedtuple('Outcome', 'key_id error')
+
+
+def validate_code(code):
+    if not re.match(r'\d{4,8}$', code):
+        raise ValueError("Access code must be a 4-8 digit number")
+
+
+class LockBackend:
+    name = 'lock'
+    supports_bulk = False
+
+    def list_keys(self, device_mac):
+        raise NotImplementedError
+
+    # Single-code operations, used by the default batch methods of backends without bulk support
+    def create(self, device_mac, access_code):
+        raise NotImplementedError
+
+    def update(self, device_mac, key_id, access_code):
+        raise NotImplementedError
+
+    def delete(self, device_mac, key_id):
+        raise NotImplementedError
+
+    # One Outcome per AccessCode, in order. A failed item does not stop the rest of the batch
+    def create_many(self, device_mac, access_codes):
+        return [self._apply(self.create, device_mac, access_code) for access_code in access_codes]
+
+    # updates are (key_id, AccessCode) pairs
+    def update_many(self, device_mac, updates):
+        return [self._apply(self.update, device_mac, key_id, access_code) for key_id, access_code in updates]
+
+    def delete_many(self, device_mac, key_ids):
+        return [self._apply(self.delete, device_mac, key_id) for key_id in key_ids]
+
+    @staticmethod
+    def _apply(fn, *args):
+        try:
+            return Outcome(fn(*args), None)
+        except Exception as e:
+            return Outcome(None, e)
+
+
+class WyzeLockBackend(LockBackend):
+    name = 'wyze'
+
+    # client is a fixed client (benchmarks), by default the token manager's client for the current token.
+    # recorder, when set, gets every call and its result (--record)
+    def __init__(self, client=None, recorder=None):
+        self.client = client
+        self.recorder = recorder
+
+    # Calls are queued on the shared API scheduler (rate limit, one mutation per lock at a time, retries
+    # with backoff) and run through the token manager so a rejected token is refreshed and the call retried once
+    def call(self, fn, device_mac=None, mutation=False, op='call'):
+        import api_scheduler
+        import token_manager
+        if self.client is not None:
+            run = lambda: fn(self.client)
+        else:
+            run = lambda: token_manager.get_token_manager().call(fn)
+        with metrics.timed('wyze_api', op=op, lock=device_mac):
+            try:
+                result = api_scheduler.get_scheduler().call(run, device_mac=device_mac, mutation=mutation)
+            except Exception as e:
+                if self.recorder is not None:
+                    self.recorder.record_call(op, device_mac, error=e)
+                raise
+        if self.recorder is not None:
+            self.recorder.record_call(op, device_mac, result=result)
+        return result
+
+    @staticmethod
+    def _permission(access_code):
+        from wyze_sdk.models.devices.locks import LockKeyPermission, LockKeyPermissionType
+        return LockKeyPermission(type=LockKeyPermissionType.DURATION, begin=access_code.begin, end=access_code.end)
+
+    def list_keys(self, device_mac):
+        return self.call(lambda client: client.locks.get_keys(device_mac=device_mac), device_mac=device_mac, op='get_keys')
+
+    # The API does not return the new key's id, it is learned the next time the lock is read
+    def create(self, device_mac, access_code):
+        validate_code(access_code.code)
+        permission = self._permission(access_code)
+        self.call(lambda client: client.locks.create_access_code(
+            device_mac=device_mac,
+            access_code=access_code.code,
+            name=access_code.name,
+            permission=permission
+        ), device_mac=device_mac, mutation=True, op='create_access_code')
+        return None
+
+    def update(self, device_mac, key_id, access_code):
+        validate_code(access_code.code)
+        permission = self._permission(access_code)
+        self.call(lambda client: client.locks.update_access_code(
+            device_mac=device_mac,
+            access_code_id=key_id,
+            access_code=access_code.code,
+            name=access_code.name,
+            permission=permission
+        ), device_mac=device_mac, mutation=True, op='update_access_code')
+        return key_id
+
+    def delete(self, device_mac, key_id):
+        self.call(lambda client: client.locks.delete_access_code(
+            device_mac=device_mac,
+            access_code_id=key_id
+        ), device_mac=device_mac, mutation=True, op='delete_access_code')
+        return key_id
+
+
+# Keys kept in memory, every batch is one request. latency is added to each request, to see what
+# batching saves against a slow API. Every change is logged with the (possibly virtual) time
+class InMemoryLockBackend(LockBackend):
+    name = 'memory'
+    supports_bulk = True
+
+    def __init__(self, initial_keys=None, latency=0.0):
+        self.keys = {mac: {key.id: key for key in keys} for mac, keys in (initial_keys or {}).items()}
+        start = max((int(key.id) for keys in self.keys.values() for key in keys.values() if key.id is not None), default=0)
+        self.ids = itertools.count(start + 1)
+        self.latency = latency
+        self.requests = Counter()  # requests by operation, one per batch
+        self.changes = Counter()  # keys created, updated and deleted
+        self.log = []
+        self.lock = threading.Lock()
+
+    def _request(self, op):
+        with self.lock:
+            self.requests[op] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _change(self, op, device_mac, key):
+        end = getattr(key.permission, 'end', None)
+        self.changes[op] += 1
+        self.log.append({'at': clock.time(), 'op': op, 'lock': device_mac, 'name': key.name, 'end': end.timestamp() if end is not None else None})
+
+    @staticmethod
+    def _key(key_id, access_code):
+        return SimpleNamespace(id=key_id, name=access_code.name, code=access_code.code,
+                               permission=SimpleNamespace(begin=access_code.begin, end=access_code.end))
+
+    def list_keys(self, device_mac):
+        self._request('list_keys')
+        with self.lock:
+            return list(self.keys.get(device_mac, {}).values())
+
+    def create_many(self, device_mac, access_codes):
+        self._request('create_many')
+        outcomes = []
+        with self.lock:
+            for access_code in access_codes:
+                try:
+                    validate_code(access_code.code)
+                except ValueError as e:
+                    outcomes.append(Outcome(None, e))
+                    continue
+                key = self._key(next(self.ids), access_code)
+                self.keys.setdefault(device_mac, {})[key.id] = key
+                self._change('create', device_mac, key)
+                outcomes.append(Outcome(key.id, None))
+        return outcomes
+
+    def update_many(self, device_mac, updates):
+        self._request('update_many')
+        outcomes = []
+        with self.lock:
+            keys = self.keys.get(device_mac, {})
+            for key_id, access_code in updates:
+                try:
+                    validate_code(access_code.code)
+                except ValueError as e:
+                    outcomes.append(Outcome(None, e))
+                    continue
+                if int(key_id) not in keys:
+                    outcomes.append(Outcome(None, KeyError(f"no key {key_id} on {device_mac}")))
+                    continue
+                key = keys[int(key_id)] = self._key(int(key_id), access_code)
+                self._change('update', device_mac, key)
+                outcomes.append(Outcome(key.id, None))
+        return outcomes
+
+    def delete_many(self, device_mac, key_ids):
+        self._request('delete_many')
+        outcomes = []
+        with self.lock:
+            keys = self.keys.get(device_mac, {})
+            for key_id in key_ids:
+                key = keys.pop(int(key_id), None)
+                if key is None:
+                    outcomes.append(Outcome(None, KeyError(f"no key {key_id} on {device_mac}")))
+                    continue
+                self._change('delete', device_mac, key)
+                outcomes.append(Outcome(key_id, None))
+        return outcomes
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = WyzeLockBackend()
+    return _backend
+
+
+def use_backend(backend):
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -0,0 +1,158 @@
+#metrics.py
+# In-process metrics for the sync pipeline: latency histograms and success/failure counters per stage
+# (fetch, parse, normalize, Wyze API calls, email, cleanup) plus per-home gauges. The daemon serves them
+# in the Prometheus text format on METRICS_PORT, and every timed stage can also be appended to a
+# JSON-lines file (METRICS_LOG_PATH).
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_PORT = int(os.getenv('METRICS_PORT') or 0)
+METRICS_BIND = os.getenv('METRICS_BIND', '127.0.0.1')
+METRICS_LOG_PATH = os.getenv('METRICS_LOG_PATH')
+
+# Upper bounds in seconds, from a cached feed read up to a throttled lock call
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for key, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+class Metrics:
+    def __init__(self, log_path=METRICS_LOG_PATH):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (stage, labels) -> [bucket counts..., sum, count]
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}  # (name, labels) -> value
+        self.collectors = []
+        self.log = open(log_path, 'a', buffering=1) if log_path else None
+        self.server = None
+
+    def observe(self, stage, seconds, ok=True, **labels):
+        key = (stage, _labels(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+            result = (('result', 'success' if ok else 'failure'),)
+            counter = ('stage_total', tuple(sorted(key[1] + (('stage', stage),) + result)))
+            self.counters[counter] = self.counters.get(counter, 0) + 1
+            if self.log is not None:
+                self.log.write(json.dumps({'ts': round(time.time(), 3), 'stage': stage, 'seconds': round(seconds, 6), 'ok': ok, **dict(key[1])}) + '\n')
+
+    # Time the block as one run of a stage, counted as a failure if it raises
+    @contextmanager
+    def timed(self, stage, **labels):
+        started = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.observe(stage, time.perf_counter() - started, ok, **labels)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, _labels(labels))] = value
+
+    # fn() returns {name: value} or {name: [(labels dict, value), ...]}, read as gauges at every scrape
+    def register_collector(self, fn):
+        with self.lock:
+            self.collectors.append(fn)
+
+    def render(self):
+        with self.lock:
+            histograms = {key: list(value) for key, value in self.histograms.items()}
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            collectors = list(self.collectors)
+        for collector in collectors:
+            try:
+                for name, samples in collector().items():
+                    if not isinstance(samples, list):
+                        samples = [({}, samples)]
+                    for labels, value in samples:
+                        gauges[(name, _labels(labels))] = value
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+
+        lines = ['# HELP wyze_stage_seconds Latency of each pipeline stage', '# TYPE wyze_stage_seconds histogram']
+        for (stage, labels), histogram in sorted(histograms.items()):
+            base = labels + (('stage', stage),)
+            for bound, count in zip(BUCKETS, histogram):
+                lines.append(f"wyze_stage_seconds_bucket{_format_labels(tuple(sorted(base + (('le', repr(bound)),))))} {count}")
+            lines.append(f"wyze_stage_seconds_bucket{_format_labels(tuple(sorted(base + (('le', '+Inf'),))))} {histogram[-1]}")
+            lines.append(f"wyze_stage_seconds_sum{_format_labels(tuple(sorted(base)))} {histogram[-2]}")
+            lines.append(f"wyze_stage_seconds_count{_format_labels(tuple(sorted(base)))} {histogram[-1]}")
+        for kind, samples in (('counter', counters), ('gauge', gauges)):
+            typed = set()
+            for (name, labels), value in sorted(samples.items()):
+                metric = f"wyze_{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} {kind}")
+                    typed.add(metric)
+                lines.append(f"{metric}{_format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    # Serve /metrics from a background thread
+    def serve(self, port=METRICS_PORT, bind=METRICS_BIND):
+        if not port or self.server is not None:
+            return
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((bind, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        print(f"Serving metrics on http://{bind}:{port}/metrics")
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+    return _metrics
+
+
+def timed(stage, **labels):
+    return get_metrics().timed(stage, **labels)
@@ -0,0 +1,159 @@
+#notifier.py
+# Background email notifications. Codes set during a sync cycle are collected per home and
+# sent as one digest email per home once the cycle is done, over a single SMTP connection that
+# stays logged in between digests. Provisioning never waits on the mail server.
+import os
+import queue
+import smtplib
+import threading
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import metrics
+
+# Close the SMTP connection when nothing has been sent for this many seconds
+SMTP_IDLE_TIMEOUT = int(os.getenv('SMTP_IDLE_TIMEOUT', '60'))
+
+
+def smtp_settings():
+    return {
+        'mail_to': os.getenv('MAIL_TO'),
+        'host': os.getenv('SMTP_HOST'),
+        'port': os.getenv('SMTP_PORT'),
+        'user': os.getenv('SMTP_USERNAME'),
+        'password': os.getenv('SMTP_PASSWORD'),
+        'from': os.getenv('SMTP_FROM'),
+        'starttls': os.getenv('SMTP_STARTTLS', 'true').lower() != 'false',
+    }
+
+
+# One authenticated SMTP connection, reopened when the server drops it
+class SmtpConnection:
+    def __init__(self, settings):
+        self.settings = settings
+        self.server = None
+
+    def _connect(self):
+        server = smtplib.SMTP(self.settings['host'], int(self.settings['port']), timeout=30)
+        if self.settings['starttls']:
+            server.starttls()
+        if self.settings['user'] and self.settings['password']:
+            server.login(self.settings['user'], self.settings['password'])
+        self.server = server
+
+    def send(self, msg):
+        for attempt in range(2):
+            try:
+                if self.server is None:
+                    self._connect()
+                self.server.sendmail(self.settings['from'], msg['To'], msg.as_string())
+                return
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError):
+                self.close()
+                if attempt == 1:
+                    raise
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.server = None
+
+
+#Send email alert with roll up of locks set by homes and times/dates
+def build_digest(settings, home, codes):
+    lines = []
+    for code, check_in, check_out in codes:
+        check_in_str = check_in.strftime('%d %B %Y %H:%M')
+        check_out_str = check_out.strftime('%d %B %Y %H:%M')
+        lines.append(f"    Lock: {code}\n    Duration: {check_in_str} - {check_out_str}\n")
+    codes_text = "\n".join(lines)
+
+    Email_Subject = f"Wyze Lock Update: {home}"
+    Email_Body = f"""
+    Wyze Lock Update for Home: {home}
+
+    Lock Information:
+    -----------------
+{codes_text}
+    This is an automated message.
+    """
+
+    msg = MIMEMultipart()
+    msg['From'] = settings['from']
+    msg['To'] = settings['mail_to']
+    msg['Subject'] = Email_Subject
+    msg.attach(MIMEText(Email_Body, 'plain'))
+    return msg
+
+
+class NotificationDispatcher:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.worker = None
+        self.sink = None  # sink(home, codes) receives the digests instead of the mail server, used by --replay
+
+    # Remember a code that was set, it goes out with the home's digest on the next flush()
+    def add(self, home, code, check_in, check_out):
+        with self.lock:
+            self.pending.setdefault(home, []).append((code, check_in, check_out))
+
+    # Queue one digest per home for everything added since the last flush
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            if self.sink is not None:
+                for home, codes in pending.items():
+                    self.sink(home, codes)
+                return
+            if pending and (self.worker is None or not self.worker.is_alive()):
+                self.worker = threading.Thread(target=self._run, name="notifier", daemon=True)
+                self.worker.start()
+        for home, codes in pending.items():
+            self.queue.put((home, codes))
+
+    # Flush and wait for queued emails to be sent, used before a one-shot CLI run exits
+    def close(self, timeout=60):
+        self.flush()
+        if self.worker is not None and self.worker.is_alive():
+            self.queue.put(None)
+            self.worker.join(timeout)
+
+    def _run(self):
+        settings = smtp_settings()
+        connection = SmtpConnection(settings)
+        while True:
+            try:
+                item = self.queue.get(timeout=SMTP_IDLE_TIMEOUT)
+            except queue.Empty:
+                connection.close()
+                continue
+            if item is None:
+                connection.close()
+                return
+            home, codes = item
+            if not all([settings['mail_to'], settings['host'], settings['port'], settings['from']]):
+                print("Error: Missing environment variables for email configuration.")
+                continue
+            try:
+                with metrics.timed('email', home=home):
+                    connection.send(build_digest(settings, home, codes))
+                print(f"Email sent successfully for {home} ({len(codes)} codes).")
+            except Exception as e:
+                print(f"Failed to send email for {home}: {e}")
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher()
+    return _dispatcher
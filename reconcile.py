@@ -0,0 +1,64 @@
+#reconcile.py
+# Compares the access codes the bookings call for with the keys already on a lock
+# and returns only the changes needed to bring the lock in line.
+# The lock does not hand the code back in clear text, so a key is identified by its
+# name (check-in weekday and length of stay) together with the end of its permission window.
+# Window ends are compared as epoch seconds: the SDK returns naive local times while bookings
+# carry the home's timezone.
+from types import SimpleNamespace
+
+MANAGED_SUFFIX = "days"
+
+
+# Name given to the codes this script creates, e.g. "Fri-3days"
+def code_name(check_in, check_out):
+    days_stay = (check_out - check_in).days
+    return f"{check_in.strftime('%a')}-{days_stay}{MANAGED_SUFFIX}"
+
+
+# Stand-in for a key just created or updated on a lock, a new key's id is only known once the lock is read again
+def pending_key(check_in, check_out, key_id=None):
+    return SimpleNamespace(id=key_id, name=code_name(check_in, check_out), permission=SimpleNamespace(end=check_out))
+
+
+def end_stamp(when):
+    return int(when.timestamp())
+
+
+# End of a key's window in epoch seconds, None for keys without one (e.g. permanent codes)
+def key_end(key):
+    permission = getattr(key, 'permission', None)
+    end = getattr(permission, 'end', None)
+    return end_stamp(end) if end is not None else None
+
+
+def is_managed(key):
+    return bool(key.name) and key.name.endswith(MANAGED_SUFFIX)
+
+
+# Desired state: (device_mac, name, end) -> (uid, code, check_in, check_out) for every stay not yet over
+def desired_codes(device_mac, codes, now):
+    desired = {}
+    for uid, code, check_in, check_out in codes:
+        if check_out <= now:
+            continue
+        desired[(device_mac, code_name(check_in, check_out), end_stamp(check_out))] = (uid, code, check_in, check_out)
+    return desired
+
+
+# Actual state: (device_mac, name, end) -> LockKey for the keys this script manages
+def actual_codes(device_mac, keys):
+    return {(device_mac, key.name, key_end(key)): key for key in keys if is_managed(key)}
+
+
+# Returns (to_create, to_delete, matched) where matched pairs desired codes with the key already on the lock.
+# Without prune, keys missing from the desired set are left alone. Keys matching `shared`, the codes of the
+# other homes on the same lock, are never pruned
+def plan(device_mac, codes, keys, now, prune=True, shared=()):
+    desired = desired_codes(device_mac, codes, now)
+    kept = desired_codes(device_mac, shared, now)
+    actual = actual_codes(device_mac, keys)
+    to_create = [desired[identity] for identity in desired if identity not in actual]
+    to_delete = [actual[identity] for identity in actual if identity not in desired and identity not in kept] if prune else []
+    matched = [(desired[identity], actual[identity]) for identity in desired if identity in actual]
+    return to_create, to_delete, matched
@@ -0,0 +1,205 @@
+#replay.py
+# Record/replay archives. --record saves every iCal body the feeds return and every Wyze lock call
+# with its result to a directory. --replay runs the daemon's jobs (feed syncs, check-in syncs, check-out
+# cleanup, the daily listing) against that directory on a virtual clock: feeds are served from the
+# archive as they were at each moment and the locks are held in memory, starting from the keys first
+# read from them, so weeks of check-ins and check-outs run in seconds and two versions can be compared
+# change by change.
+#
+# Layout of an archive:
+#   homes.json       the homes as configured, feed URLs replaced by a hash (they carry a secret)
+#   feeds.jsonl      {at, feed, etag, last_modified, sha} for every full feed body received
+#   feeds/<sha>.ics  the bodies, stored once
+#   wyze.jsonl       {at, op, lock, ok, error, keys} for every lock call, keys for get_keys
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from wyze_sdk.models.devices.locks import LockKey, LockKeyPermission, LockKeyPermissionType, LockKeyType
+
+import clock
+import home_config
+
+SCHEME = 'replay://'
+
+
+# Feeds are identified by a hash of their URL, the URL itself is never written
+def url_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()[:16]
+
+
+def _stamp(when):
+    return when.timestamp() if when is not None else None
+
+
+def encode_key(key):
+    permission = key.permission
+    return {
+        'id': key.id,
+        'type': key.type.name if key.type else None,
+        'name': key.name,
+        'permission': None if permission is None else {
+            'type': permission.type.name if permission.type else None,
+            'begin': _stamp(permission.begin),
+            'end': _stamp(permission.end),
+        },
+    }
+
+
+# The SDK hands out naive local datetimes, so the keys are rebuilt the same way
+def decode_key(data):
+    permission = data.get('permission')
+    if permission is not None:
+        permission = LockKeyPermission(
+            type=LockKeyPermissionType[permission['type']] if permission['type'] else LockKeyPermissionType.ALWAYS,
+            begin=datetime.fromtimestamp(permission['begin']) if permission['begin'] is not None else None,
+            end=datetime.fromtimestamp(permission['end']) if permission['end'] is not None else None,
+        )
+    key_type = LockKeyType[data['type']] if data.get('type') else LockKeyType.ACCESS_CODE
+    return LockKey(id=data['id'], type=key_type, name=data['name'], permission=permission)
+
+
+class ArchiveWriter:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.seen = set()
+        os.makedirs(os.path.join(path, 'feeds'), exist_ok=True)
+
+    def _append(self, name, record):
+        with open(os.path.join(self.path, name), 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def write_homes(self, homes):
+        records = [{
+            'name': home.name,
+            'feed': url_key(home.ical_url),
+            'lock_device_mac': home.lock_device_mac,
+            'check_in_time': home.check_in_time.strftime('%H:%M'),
+            'check_out_time': home.check_out_time.strftime('%H:%M'),
+            'timezone': home.timezone,
+        } for home in homes]
+        with open(os.path.join(self.path, 'homes.json'), 'w') as f:
+            json.dump(records, f, indent=2)
+
+    # requests response hook. Only full bodies are kept, a 304 means the last one recorded still applies
+    def record_response(self, response, *args, **kwargs):
+        if response.status_code != 200:
+            return
+        url = response.history[0].url if response.history else response.url
+        body = response.content
+        sha = hashlib.sha256(body).hexdigest()
+        with self.lock:
+            if sha not in self.seen:
+                self.seen.add(sha)
+                body_path = os.path.join(self.path, 'feeds', f"{sha}.ics")
+                if not os.path.exists(body_path):
+                    with open(body_path, 'wb') as f:
+                        f.write(body)
+            self._append('feeds.jsonl', {
+                'at': time.time(),
+                'feed': url_key(url),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'sha': sha,
+            })
+
+    def record_call(self, op, device_mac, result=None, error=None):
+        record = {'at': time.time(), 'op': op, 'lock': device_mac, 'ok': error is None, 'error': None if error is None else str(error)}
+        if op == 'get_keys' and error is None:
+            record['keys'] = [encode_key(key) for key in result or []]
+        with self.lock:
+            self._append('wyze.jsonl', record)
+
+
+class Archive:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'homes.json')) as f:
+            self.home_records = json.load(f)
+        self.feeds = {}
+        for record in self._read('feeds.jsonl'):
+            self.feeds.setdefault(record['feed'], []).append(record)
+        for versions in self.feeds.values():
+            versions.sort(key=lambda record: record['at'])
+        self.calls = self._read('wyze.jsonl')
+
+    def _read(self, name):
+        try:
+            with open(os.path.join(self.path, name)) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    # Homes as load_homes() returns them, reading their feeds from the archive
+    def homes(self):
+        return [home_config.make_home(dict(record, ical_url=f"{SCHEME}{record['feed']}")) for record in self.home_records]
+
+    # When recording started, where the virtual clock begins
+    def start(self):
+        times = [record['at'] for versions in self.feeds.values() for record in versions]
+        times += [record['at'] for record in self.calls]
+        return min(times) if times else time.time()
+
+    # The keys on each lock the first time it was read, the simulated locks start from these
+    def initial_keys(self):
+        keys = {}
+        for record in self.calls:
+            if record['op'] == 'get_keys' and record['ok'] and record['lock'] not in keys:
+                keys[record['lock']] = [decode_key(data) for data in record['keys']]
+        return keys
+
+    # The feed version in effect at `at`, the first one recorded before that
+    def version(self, feed, at):
+        versions = self.feeds.get(feed)
+        if not versions:
+            return None
+        current = versions[0]
+        for record in versions:
+            if record['at'] > at:
+                break
+            current = record
+        return current
+
+    def body(self, sha):
+        with open(os.path.join(self.path, 'feeds', f"{sha}.ics"), 'rb') as f:
+            return f.read()
+
+
+# Serves replay://<feed> from the archive at the virtual clock's time, with ETags so the feed cache
+# sees 304s exactly when the recorded feed did not change
+class ReplayAdapter(BaseAdapter):
+    def __init__(self, archive):
+        super().__init__()
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        response = Response()
+        response.request = request
+        response.url = request.url
+        response.encoding = 'utf-8'
+        response.headers = CaseInsensitiveDict()
+        response._content_consumed = True
+        version = self.archive.version(request.url[len(SCHEME):], clock.time())
+        if version is None:
+            response.status_code = 404
+            response._content = b''
+            return response
+        etag = f'"{version["sha"][:16]}"'
+        response.headers['ETag'] = etag
+        if request.headers.get('If-None-Match') == etag:
+            response.status_code = 304
+            response._content = b''
+        else:
+            response.status_code = 200
+            response._content = self.archive.body(version['sha'])
+        return response
+
+    def close(self):
+        pass
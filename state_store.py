@@ -0,0 +1,156 @@
+#state_store.py
+# Local SQLite record of every booking seen and the access code provisioned for it,
+# so cleanup and listings are indexed queries instead of scans of every lock,
+# and a restart picks up where the last run left off. Times are stored in UTC.
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+import clock
+from booking_changes import content_hash
+from reconcile import code_name
+
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'wyze_state.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bookings (
+    home TEXT NOT NULL,
+    uid TEXT NOT NULL,
+    device_mac TEXT,
+    code TEXT,
+    name TEXT,
+    check_in TEXT NOT NULL,
+    check_out TEXT NOT NULL,
+    key_id TEXT,
+    provisioned_at TEXT,
+    content_hash TEXT,
+    PRIMARY KEY (home, uid)
+);
+CREATE INDEX IF NOT EXISTS idx_bookings_check_out ON bookings (check_out);
+CREATE INDEX IF NOT EXISTS idx_bookings_check_in ON bookings (check_in);
+CREATE INDEX IF NOT EXISTS idx_bookings_device ON bookings (device_mac, check_out);
+"""
+
+
+# UTC ISO string, so stored times from homes in different timezones compare as text.
+# Naive datetimes are taken as local time
+def _iso(value):
+    return value.astimezone(timezone.utc).isoformat()
+
+
+def _to_row(row):
+    booking = dict(row)
+    booking['check_in'] = datetime.fromisoformat(booking['check_in'])
+    booking['check_out'] = datetime.fromisoformat(booking['check_out'])
+    return booking
+
+
+class StateStore:
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        # sharded daemon workers share the database, WAL lets them read while another one writes
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def _query(self, sql, params=()):
+        with self.lock:
+            return [_to_row(row) for row in self.conn.execute(sql, params).fetchall()]
+
+    # Insert or refresh the bookings of a home. A booking whose code, lock or window changed
+    # loses its provisioned state so it gets set again
+    def record_bookings(self, home, device_mac, codes):
+        with self.lock, self.conn:
+            existing = {
+                row['uid']: (row['device_mac'], row['code'], row['check_in'], row['check_out'])
+                for row in self.conn.execute("SELECT uid, device_mac, code, check_in, check_out FROM bookings WHERE home = ?", (home,))
+            }
+            for uid, code, check_in, check_out in codes:
+                values = (device_mac, code, _iso(check_in), _iso(check_out))
+                if uid not in existing:
+                    self.conn.execute(
+                        "INSERT INTO bookings (home, uid, device_mac, code, name, check_in, check_out, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (home, uid, device_mac, code, code_name(check_in, check_out), values[2], values[3], content_hash(code, check_in, check_out)),
+                    )
+                elif existing[uid] != values:
+                    self.conn.execute(
+                        """
+                        UPDATE bookings SET device_mac = ?, code = ?, name = ?, check_in = ?, check_out = ?,
+                            content_hash = ?, key_id = NULL, provisioned_at = NULL
+                        WHERE home = ? AND uid = ?
+                        """,
+                        (device_mac, code, code_name(check_in, check_out), values[2], values[3],
+                         content_hash(code, check_in, check_out), home, uid),
+                    )
+
+    # A provisioned code was updated in place on the lock, move the booking to its new code and window
+    def update_booking(self, home, uid, code, check_in, check_out, key_id):
+        with self.lock, self.conn:
+            self.conn.execute(
+                """
+                UPDATE bookings SET code = ?, name = ?, check_in = ?, check_out = ?, content_hash = ?,
+                    key_id = ?, provisioned_at = ?
+                WHERE home = ? AND uid = ?
+                """,
+                (code, code_name(check_in, check_out), _iso(check_in), _iso(check_out), content_hash(code, check_in, check_out),
+                 str(key_id), _iso(clock.now_utc()), home, uid),
+            )
+
+    def mark_provisioned(self, home, uid, key_id=None):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE bookings SET provisioned_at = ?, key_id = COALESCE(?, key_id) WHERE home = ? AND uid = ?",
+                (_iso(clock.now_utc()), None if key_id is None else str(key_id), home, uid),
+            )
+
+    def forget(self, home, uid):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM bookings WHERE home = ? AND uid = ?", (home, uid))
+
+    # Drop every booking of a home, e.g. when it moved to another lock
+    def forget_home(self, home):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM bookings WHERE home = ?", (home,))
+
+    def bookings_for_home(self, home):
+        return self._query("SELECT * FROM bookings WHERE home = ?", (home,))
+
+    # Bookings of every home whose codes go on a lock
+    def bookings_for_lock(self, device_mac):
+        return self._query("SELECT * FROM bookings WHERE device_mac = ?", (device_mac,))
+
+    def all_bookings(self):
+        return self._query("SELECT * FROM bookings ORDER BY check_in")
+
+    # Provisioned codes on a lock whose stay ends at or before the given time
+    def expired(self, device_mac, until):
+        return self._query(
+            "SELECT * FROM bookings WHERE device_mac = ? AND check_out <= ? AND provisioned_at IS NOT NULL ORDER BY check_out",
+            (device_mac, _iso(until)),
+        )
+
+    def is_empty(self):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM bookings LIMIT 1").fetchone() is None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = StateStore()
+    return _store
+
+
+def use_store(store):
+    global _store
+    with _store_lock:
+        _store = store
@@ -0,0 +1,101 @@
+#timeline.py
+# Normalized, timezone-aware bookings for every home, built once per sync cycle.
+# Check-in/out times are attached in the home's own timezone (HOME_<n>_TIMEZONE, or TIMEZONE for
+# all homes, the machine's local zone otherwise), and bookings are kept sorted by check-in and by
+# check-out so "starting/ending in [t0, t1)" is two bisects instead of a refetch and a scan.
+import bisect
+from dataclasses import dataclass
+from datetime import datetime
+
+import pytz
+
+import clock
+from reconcile import code_name
+
+
+@dataclass(frozen=True)
+class Booking:
+    __slots__ = ('home', 'uid', 'device_mac', 'code', 'name', 'guest_name', 'check_in', 'check_out')
+    home: str
+    uid: str
+    device_mac: str
+    code: str
+    name: str
+    guest_name: str
+    check_in: datetime
+    check_out: datetime
+
+    # (uid, code, check_in, check_out), the shape reconcile and the state store work with
+    def as_code(self):
+        return (self.uid, self.code, self.check_in, self.check_out)
+
+
+def get_timezone(name):
+    return pytz.timezone(name) if name else None
+
+
+# Attach a timezone to a wall-clock time at the home, the machine's local zone when the home has none
+def localize(naive, tz):
+    return tz.localize(naive) if tz is not None else naive.astimezone()
+
+
+# Booking records for a home's parsed feed, using the home's check-in/out times and timezone
+def normalize(home, bookings):
+    tz = get_timezone(home.timezone)
+    records = []
+    for booking in bookings:
+        check_in = localize(datetime.combine(booking['check_in'], home.check_in_time), tz)
+        check_out = localize(datetime.combine(booking['check_out'], home.check_out_time), tz)
+        records.append(Booking(
+            home.name, booking['uid'], home.lock_device_mac, booking['guest_phone_last4'],
+            code_name(check_in, check_out), booking.get('guest_name') or '', check_in, check_out,
+        ))
+    return records
+
+
+# The state store keeps times in UTC, shown again in the home's timezone
+def from_row(row, tz=None):
+    check_in = row['check_in'].astimezone(tz) if tz is not None else row['check_in'].astimezone()
+    check_out = row['check_out'].astimezone(tz) if tz is not None else row['check_out'].astimezone()
+    return Booking(row['home'], row['uid'], row['device_mac'], row['code'], row['name'], '', check_in, check_out)
+
+
+# Today's check-out time at a home, as an aware datetime
+def check_out_today(home, today=None):
+    tz = get_timezone(home.timezone)
+    today = today or clock.now(tz).date()
+    return localize(datetime.combine(today, home.check_out_time), tz)
+
+
+class BookingTimeline:
+    def __init__(self, bookings=()):
+        self.homes = {}
+        for booking in bookings:
+            self.homes.setdefault(booking.home, []).append(booking)
+        self._index()
+
+    def _index(self):
+        bookings = [booking for home_bookings in self.homes.values() for booking in home_bookings]
+        self.by_check_in = sorted(bookings, key=lambda booking: booking.check_in)
+        self.check_ins = [booking.check_in for booking in self.by_check_in]
+        self.by_check_out = sorted(bookings, key=lambda booking: booking.check_out)
+        self.check_outs = [booking.check_out for booking in self.by_check_out]
+
+    def __len__(self):
+        return len(self.by_check_in)
+
+    # Bookings with check-in in [start, end), in check-in order
+    def starting(self, start, end):
+        return self.by_check_in[bisect.bisect_left(self.check_ins, start):bisect.bisect_left(self.check_ins, end)]
+
+    # Bookings with check-out in [start, end), in check-out order
+    def ending(self, start, end):
+        return self.by_check_out[bisect.bisect_left(self.check_outs, start):bisect.bisect_left(self.check_outs, end)]
+
+    # A new timeline with the bookings of these homes replaced, other homes are kept as they were
+    def replace(self, homes):
+        timeline = BookingTimeline()
+        timeline.homes = dict(self.homes)
+        timeline.homes.update(homes)
+        timeline._index()
+        return timeline
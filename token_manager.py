@@ -0,0 +1,204 @@
+#token_manager.py
+# Shared Wyze token handling for wyze-lock-airbnb.py and get-access_refresh_token.py.
+# Tracks when the access token expires, refreshes it ahead of time in the background,
+# and saves tokens to the .env file atomically under a file lock so several processes
+# can share them. API calls that still hit AccessTokenError are retried once after a refresh.
+import os
+import stat
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import dotenv_values
+from wyze_sdk import Client
+from wyze_sdk.errors import WyzeApiError
+
+try:
+    import fcntl
+except ImportError:  # Windows, fall back to no cross-process locking
+    fcntl = None
+
+ENV_FILE_PATH = os.getenv('WYZE_ENV_FILE', '.env')
+# Wyze access tokens are valid for about 48 hours
+ACCESS_TOKEN_TTL = int(os.getenv('WYZE_ACCESS_TOKEN_TTL', str(48 * 3600)))
+# Refresh this many seconds before the access token expires
+REFRESH_MARGIN = int(os.getenv('WYZE_TOKEN_REFRESH_MARGIN', '3600'))
+
+
+def is_access_token_error(e):
+    message = str(e)
+    return "AccessTokenError" in message or "access token expired" in message or "access token has expired" in message
+
+
+@contextmanager
+def file_lock(path):
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Replace or append KEY=value lines and swap the file in with one rename. The file holds credentials,
+# so the new one keeps the old file's mode (owner-only for a new file)
+def write_env_values(path, values):
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        lines = []
+        mode = 0o600
+    remaining = dict(values)
+    for i, line in enumerate(lines):
+        key = line.split('=', 1)[0].strip()
+        if key in remaining:
+            lines[i] = f"{key}='{remaining.pop(key)}'"
+    lines.extend(f"{key}='{value}'" for key, value in remaining.items())
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.env.', suffix='.tmp')
+    try:
+        os.chmod(tmp_path, mode)
+        with os.fdopen(fd, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class TokenManager:
+    def __init__(self, env_path=ENV_FILE_PATH):
+        self.env_path = env_path
+        self.lock = threading.RLock()
+        self.access_token = os.getenv('WYZE_ACCESS_TOKEN')
+        self.refresh_token = os.getenv('WYZE_REFRESH_TOKEN')
+        self.expires_at = float(os.getenv('WYZE_ACCESS_TOKEN_EXPIRES_AT') or 0)
+        self._client = None
+        self._client_token = None
+        self._refresher = None
+        self._stop = threading.Event()
+
+    # Pick up tokens another process saved after we loaded ours
+    def _reload(self):
+        values = dotenv_values(self.env_path) if os.path.exists(self.env_path) else {}
+        expires_at = float(values.get('WYZE_ACCESS_TOKEN_EXPIRES_AT') or 0)
+        if values.get('WYZE_ACCESS_TOKEN') and expires_at > self.expires_at:
+            self._apply(values['WYZE_ACCESS_TOKEN'], values.get('WYZE_REFRESH_TOKEN') or self.refresh_token, expires_at)
+
+    def _apply(self, access_token, refresh_token, expires_at):
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.expires_at = expires_at
+        os.environ['WYZE_ACCESS_TOKEN'] = access_token
+        os.environ['WYZE_REFRESH_TOKEN'] = refresh_token
+        os.environ['WYZE_ACCESS_TOKEN_EXPIRES_AT'] = str(int(expires_at))
+
+    def save(self, access_token, refresh_token, expires_at=None):
+        expires_at = expires_at or time.time() + ACCESS_TOKEN_TTL
+        with self.lock, file_lock(self.env_path):
+            write_env_values(self.env_path, {
+                'WYZE_ACCESS_TOKEN': access_token,
+                'WYZE_REFRESH_TOKEN': refresh_token,
+                'WYZE_ACCESS_TOKEN_EXPIRES_AT': str(int(expires_at)),
+            })
+            self._apply(access_token, refresh_token, expires_at)
+        print("Access and refresh tokens have been saved to the .env file.")
+
+    # Expiry is unknown for tokens saved before it was tracked, those are refreshed on the first AccessTokenError
+    def needs_refresh(self):
+        return bool(self.expires_at) and time.time() >= self.expires_at - REFRESH_MARGIN
+
+    # Refresh the access token. failed_token is the token an API call was rejected with; if another
+    # process or thread already replaced it, the newer token is used instead of refreshing again
+    def refresh(self, failed_token=None):
+        with self.lock, file_lock(self.env_path):
+            self._reload()
+            if failed_token is not None and self.access_token != failed_token:
+                return self.access_token
+            if failed_token is None and not self.needs_refresh():
+                return self.access_token
+            if not self.refresh_token:
+                raise WyzeApiError("No WYZE_REFRESH_TOKEN available, run get-access_refresh_token.py", {})
+            print("Refreshing Wyze access token...")
+            response = Client(refresh_token=self.refresh_token).refresh_token()
+            data = response["data"]
+            expires_at = time.time() + ACCESS_TOKEN_TTL
+            write_env_values(self.env_path, {
+                'WYZE_ACCESS_TOKEN': data['access_token'],
+                'WYZE_REFRESH_TOKEN': data['refresh_token'],
+                'WYZE_ACCESS_TOKEN_EXPIRES_AT': str(int(expires_at)),
+            })
+            self._apply(data['access_token'], data['refresh_token'], expires_at)
+            return self.access_token
+
+    # A client for the current access token, created without any validation request
+    @property
+    def client(self):
+        with self.lock:
+            if self.needs_refresh():
+                self.refresh()
+            if self._client is None or self._client_token != self.access_token:
+                self._client = Client(token=self.access_token)
+                self._client_token = self.access_token
+            return self._client
+
+    # Run fn(client), refreshing and retrying once if the token was rejected
+    def call(self, fn):
+        client = self.client
+        token = self._client_token
+        try:
+            return fn(client)
+        except WyzeApiError as e:
+            if not is_access_token_error(e):
+                raise
+            print("Access token rejected, refreshing...")
+            self.refresh(failed_token=token)
+            return fn(self.client)
+
+    # Keep the token fresh from a background thread for long running processes
+    def start_background_refresh(self):
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        self._stop.clear()
+        self._refresher = threading.Thread(target=self._refresh_loop, name="token-refresh", daemon=True)
+        self._refresher.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            if self.expires_at:
+                wait = max(self.expires_at - REFRESH_MARGIN - time.time(), 0)
+            else:
+                wait = REFRESH_MARGIN
+            # wake up at least every 5 minutes to notice tokens saved by other processes
+            if self._stop.wait(min(wait, 300)):
+                return
+            try:
+                with self.lock, file_lock(self.env_path):
+                    self._reload()
+                if self.needs_refresh():
+                    self.refresh()
+            except Exception as e:
+                print(f"Failed to refresh access token: {e}")
+                if self._stop.wait(60):
+                    return
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_token_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = TokenManager()
+    return _manager
@@ -1,167 +1,114 @@
 #wyze-locak-airbnb.py
-import requests
-from icalendar import Calendar
-from wyze_sdk import Client
-from wyze_sdk.errors import WyzeApiError, WyzeRequestError  # Ensure WyzeRequestError is imported
-from wyze_sdk.models.devices.locks import LockKey, LockKeyPermission, LockKeyPeriodicity
-import re
-import schedule
 import time
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import os
 import argparse
-#import smtp as smtplib
-import pytz
+import contextlib
+import json
+import shutil
+import signal
+import tempfile
+import subprocess
+import sys
+import threading
 import smtplib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Constants
-HOMES = [
-    {
-        'name': os.getenv('HOME_1_NAME'),
-        'ical_url': os.getenv('HOME_1_ICAL_URL'),
-        'lock_device_mac': os.getenv('HOME_1_LOCK_DEVICE_MAC'),
-        'check_in_time': os.getenv('HOME_1_CHECK_IN_TIME'),
-        'check_out_time': os.getenv('HOME_1_CHECK_OUT_TIME')
-    },
-    {
-        'name': os.getenv('HOME_2_NAME'),
-        'ical_url': os.getenv('HOME_2_ICAL_URL'),
-        'lock_device_mac': os.getenv('HOME_2_LOCK_DEVICE_MAC'),
-        'check_in_time': os.getenv('HOME_2_CHECK_IN_TIME'),
-        'check_out_time': os.getenv('HOME_2_CHECK_OUT_TIME')
-    }
-]
-WYZE_ACCESS_TOKEN = os.getenv('WYZE_ACCESS_TOKEN')
-WYZE_REFRESH_TOKEN = os.getenv('WYZE_REFRESH_TOKEN')
-#Send email alert with roll up of locks set by homes and times/dates. This should run each time a lock is set
-def sendEmail(home, lock, check_in, check_out):
-    MAIL_TO = os.getenv('MAIL_TO')
-    SMTP_HOST = os.getenv('SMTP_HOST')
-    SMTP_PORT = os.getenv('SMTP_PORT')
-    SMTP_USER = os.getenv('SMTP_USERNAME')
-    SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
-    SMTP_FROM = os.getenv('SMTP_FROM')
-
-    # Check if necessary environment variables are set
-    if not all([MAIL_TO, SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, SMTP_FROM]):
-        print("Error: Missing environment variables for email configuration.")
-        return False
-
-    # Format the check-in and check-out times
-    check_in_str = check_in.strftime('%d %B %Y %H:%M')
-    check_out_str = check_out.strftime('%d %B %Y %H:%M')
-
-    Email_Subject = f"Wyze Lock Update: {home}"
-    Email_Body = f"""
-    Wyze Lock Update for Home: {home}
-
-    Lock Information:
-    -----------------
-    Lock: {lock}
-    Duration: {check_in_str} - {check_out_str}
-
-    This is an automated message.
-    """
-
-    msg = MIMEMultipart()
-    msg['From'] = SMTP_FROM
-    msg['To'] = MAIL_TO
-    msg['Subject'] = Email_Subject
-    msg.attach(MIMEText(Email_Body, 'plain'))
+# local modules read their settings from the environment when imported.
+# wyze_sdk and requests, and the modules built on them (api_scheduler, feed_cache, token_manager, replay,
+# the Wyze lock backend), are imported where they are first needed so modes that never reach Wyze or a feed skip them
+import ical_stream
+import reconcile
+import state_store
+import event_scheduler
+import key_inventory
+import clock
+import booking_changes
+import metrics
+import timeline
+import leases
+import home_config
+import notifier
+import lock_backends
 
+# Constants
+# Homes come from the config file (HOME_CONFIG_PATH) or the numbered HOME_<n>_* variables,
+# read the first time a mode needs them. A config file that does not validate stops the script:
+# unlike a reload there are no running homes to keep
+def load_homes():
     try:
-        server = smtplib.SMTP(SMTP_HOST, int(SMTP_PORT))
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASSWORD)
-        server.sendmail(SMTP_FROM, MAIL_TO, msg.as_string())
-        server.quit()
-        print("Email sent successfully.")
-        return True
-    except Exception as e:
-        print(f"Failed to send email: {e}")
-        return False
-# Function to refresh the access token
-def refresh_access_token(refresh_token):
-    url = "https://api.wyzecam.com/app/user/refresh_token"
-    payload = {
-        "app_ver": "wyze_developer_api",
-        "app_version": "wyze_developer_api",
-        "phone_id": "wyze_developer_api",
-        "refresh_token": refresh_token,
-        "sc": "wyze_developer_api",
-        "sv": "wyze_developer_api",
-        "ts": int(time.time() * 1000)
-    }
-    headers = {
-        "Content-Type": "application/json"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    if response.status_code == 200:
-        data = response.json()
-        new_access_token = data['data']['access_token']
-        new_refresh_token = data['data']['refresh_token']
-        return new_access_token, new_refresh_token
-    else:
-        raise Exception(f"Failed to refresh token: {response.status_code} - {response.text}")
-
-# Function to get the client
-def get_client():
-    global WYZE_ACCESS_TOKEN, WYZE_REFRESH_TOKEN
-    try:
-        client = Client(token=WYZE_ACCESS_TOKEN)
-        # Test if the access token is valid
-        client.devices_list()
-    except WyzeApiError as e:
-        if "AccessTokenError" in str(e) or "access token expired" in str(e):
-            print("Access token expired, refreshing...")
-            try:
-                WYZE_ACCESS_TOKEN, WYZE_REFRESH_TOKEN = refresh_access_token(WYZE_REFRESH_TOKEN)
-                os.environ['WYZE_ACCESS_TOKEN'] = WYZE_ACCESS_TOKEN
-                os.environ['WYZE_REFRESH_TOKEN'] = WYZE_REFRESH_TOKEN
-                client = Client(token=WYZE_ACCESS_TOKEN)
-            except Exception as refresh_error:
-                print(f"Failed to refresh access token: {refresh_error}")
-                raise e  # Re-raise the original error if refreshing fails
-        else:
-            raise e  # Re-raise the original error if it's not an access token issue
-    return client
+        return home_config.load_homes()
+    except home_config.ConfigError as e:
+        print(f"Invalid home configuration in {home_config.HOME_CONFIG_PATH}: {e}")
+        sys.exit(1)
+
+HOMES = None
+_homes_lock = threading.Lock()
+
+def get_homes():
+    global HOMES
+    with _homes_lock:
+        if HOMES is None:
+            HOMES = load_homes()
+    return HOMES
+
+# Concurrency limits for a sync cycle: feed downloads in flight and locks provisioned at once
+SYNC_MAX_WORKERS = int(os.getenv('SYNC_MAX_WORKERS', '8'))
+LOCK_MAX_WORKERS = int(os.getenv('LOCK_MAX_WORKERS', '4'))
+# Sharded daemon: pause before restarting a worker that exited, doubled while it keeps crashing
+WORKER_RESTART_DELAY = int(os.getenv('WORKER_RESTART_DELAY', '5'))
+# Daemon timing: how often feeds are re-read, and how long before check-in a home is synced again
+FEED_REFRESH_MINUTES = int(os.getenv('FEED_REFRESH_MINUTES', '15'))
+CODE_LEAD_MINUTES = int(os.getenv('CODE_LEAD_MINUTES', '60'))
+# Check-ins and check-outs further out than this are planned on a later feed refresh
+PLAN_HORIZON_HOURS = 48
+
+# Keys on a lock, served from the key inventory when it was read recently
+def get_lock_keys(device_mac, require_ids=False):
+    fetch = lambda: lock_backends.get_backend().list_keys(device_mac)
+    return key_inventory.get_inventory().get(device_mac, fetch, require_ids=require_ids)
 
 # Mock function for get_crypt_secret since actual endpoint is unknown
 def get_crypt_secret():
     # This is a mock function. Replace this with actual functionality if available.
     return "mock_secret"
 
-def fetch_airbnb_bookings(ical_url):
-    response = requests.get(ical_url)
-    response.raise_for_status()
-    calendar = Calendar.from_ical(response.text)
-    
-    bookings = []
-    for component in calendar.walk():
-        if component.name == "VEVENT" and 'Reserved' in component.get('SUMMARY'):
-            description = component.get('DESCRIPTION')
-            phone_match = re.search(r'Phone Number \(Last 4 Digits\): (\d{4})', description)
-            if phone_match:
-                phone_last4 = phone_match.group(1)
-                check_in = component.get('DTSTART').dt
-                check_out = component.get('DTEND').dt
-                days_stay = (check_out - check_in).days
-                guest_name = f"{check_in.strftime('%a')}-{days_stay}days"
-                bookings.append({
-                    'check_in': check_in,
-                    'check_out': check_out,
-                    'guest_phone_last4': phone_last4,
-                    'guest_name': guest_name
-                })
-    return bookings
+# Fetch through the shared session and feed cache, only re-parsing when the calendar changed
+def fetch_airbnb_bookings(ical_url, home=None):
+    import feed_cache
+    return feed_cache.fetch_bookings(ical_url, parse_airbnb_bookings, home=home)
+
+# Fetch every home's feed concurrently, yielding (home, bookings) as each download finishes.
+# The feed cache is written once at the end rather than after every changed feed
+def fetch_all_bookings(homes):
+    import feed_cache
+    with ThreadPoolExecutor(max_workers=SYNC_MAX_WORKERS) as pool:
+        futures = {pool.submit(fetch_airbnb_bookings, home.ical_url, home.name): home for home in homes}
+        for future in as_completed(futures):
+            home = futures[future]
+            try:
+                bookings = future.result()
+            except Exception as e:
+                print(f"Failed to fetch bookings for {home.name}: {e}")
+                continue
+            yield home, bookings
+    try:
+        feed_cache.get_cache().flush()
+    except OSError as e:
+        print(f"Failed to save the feed cache: {e}")
+
+# Stays that ended before yesterday are never acted on, so the parser skips them without building them
+def parse_airbnb_bookings(ical_text):
+    return ical_stream.parse_bookings(ical_text.splitlines(), start=clock.now() - timedelta(days=1))
+
 def sendTestEmail(email, subject, body):
+
     SMTP_HOST = os.getenv('SMTP_HOST')
     SMTP_FROM = os.getenv('SMTP_FROM')
     SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
@@ -189,124 +136,570 @@ def sendTestEmail(email, subject, body):
         print(f"Failed to send test email: {e}")
         return False
 
+# The bookings of every home as of the last sync cycle, replaced as feeds are re-read
+_timeline = timeline.BookingTimeline()
+_timeline_lock = threading.Lock()
+
+def now_utc():
+    return clock.now_utc()
+
+# Current timeline. A one-shot CLI run starts from the state store, or from the feeds on the very first run
+def get_timeline():
+    global _timeline
+    with _timeline_lock:
+        if len(_timeline):
+            return _timeline
+    store = state_store.get_store()
+    if store.is_empty():
+        refresh_booking_store(get_homes())
+    else:
+        zones = {home.name: timeline.get_timezone(home.timezone) for home in get_homes()}
+        loaded = {}
+        for row in store.all_bookings():
+            if row['home'] in zones:
+                loaded.setdefault(row['home'], []).append(timeline.from_row(row, zones[row['home']]))
+        update_timeline(loaded)
+    return _timeline
+
+def update_timeline(home_bookings):
+    global _timeline
+    with _timeline_lock:
+        _timeline = _timeline.replace(home_bookings)
+
+# Timezone-aware Booking records for a home's parsed feed
+def normalize_bookings(home, bookings):
+    with metrics.timed('normalize', home=home.name):
+        return timeline.normalize(home, bookings)
+
+# (uid, code, check_in, check_out) for each booking of a home
+def booking_codes(home, bookings):
+    return [booking.as_code() for booking in bookings]
+
+# Record the bookings of every home in the state store and timeline without touching the locks
+def refresh_booking_store(homes):
+    store = state_store.get_store()
+    fetched = {}
+    for home, bookings in fetch_all_bookings(homes):
+        fetched[home.name] = normalize_bookings(home, bookings)
+        store.record_bookings(home.name, home.lock_device_mac, booking_codes(home, fetched[home.name]))
+    update_timeline(fetched)
+
 def list_upcoming_bookings(days=7):
-    upcoming_bookings = []
-    current_time = datetime.now()
+    current_time = now_utc()
     end_time = current_time + timedelta(days=days)
-
-    for home in HOMES:
-        bookings = fetch_airbnb_bookings(home['ical_url'])
-        for booking in bookings:
-            check_in = datetime.combine(booking['check_in'], datetime.min.time())
-            check_out = datetime.combine(booking['check_out'], datetime.min.time())
-            check_in = check_in.replace(hour=int(home['check_in_time'].split(':')[0]), minute=int(home['check_in_time'].split(':')[1]))
-            check_out = check_out.replace(hour=int(home['check_out_time'].split(':')[0]), minute=int(home['check_out_time'].split(':')[1]))
-            if current_time <= check_in <= end_time:
-                upcoming_bookings.append({
-                    'home': home['name'],
-                    'check_in': check_in,
-                    'check_out': check_out,
-                    'access_code': booking['guest_phone_last4'],
-                    'guest_name': booking['guest_name']
-                })
-
-    for booking in upcoming_bookings:
-        print(f"Home: {booking['home']}, Guest: {booking['guest_name']}, Check-in: {booking['check_in']}, Check-out: {booking['check_out']}, Access Code: {booking['access_code']}")
+    for booking in get_timeline().starting(current_time, end_time):
+        print(f"Home: {booking.home}, Guest: {booking.guest_name or booking.name}, Check-in: {booking.check_in}, Check-out: {booking.check_out}, Access Code: {booking.code}")
 
 def process_bookings_for_days(days):
-    current_time = datetime.now()
+    current_time = now_utc()
     end_time = current_time + timedelta(days=days)
 
-    for home in HOMES:
-        bookings = fetch_airbnb_bookings(home['ical_url'])
-        for booking in bookings:
-            check_in = datetime.combine(booking['check_in'], datetime.min.time())
-            check_out = datetime.combine(booking['check_out'], datetime.min.time())
-            check_in = check_in.replace(hour=int(home['check_in_time'].split(':')[0]), minute=int(home['check_in_time'].split(':')[1]))
-            check_out = check_out.replace(hour=int(home['check_out_time'].split(':')[0]), minute=int(home['check_out_time'].split(':')[1]))
-            if current_time <= check_in <= end_time:
-                create_access_code(home['lock_device_mac'], booking['guest_phone_last4'], check_in, check_out)
-
-def create_access_code(device_mac, guest_phone_last4, check_in, check_out):
-    access_code = str(guest_phone_last4).encode()  # Ensure access_code is a string
-    access_code = str(access_code)  
-    print(f"DEBUG: Access code before validation: {access_code}")  # Debug print
-    days_stay = (check_out - check_in).days
-    name = f"{check_in.strftime('%a')}-{days_stay}days"
-
-    permission = LockKeyPermission(can_unlock=True, can_lock=True)
-    periodicity = LockKeyPeriodicity(
-        begin=check_in.strftime("%H%M%S"),
-        end=check_out.strftime("%H%M%S"),
-        valid_days=[0, 1, 2, 3, 4, 5, 6]
-    )
-
+    def select_codes(home, bookings):
+        return booking_codes(home, timeline.BookingTimeline(bookings).starting(current_time, end_time))
+
+    # only add codes here, codes outside the window are left for the regular sync
+    sync_homes(get_homes(), select_codes, prune=False)
+
+_device_locks = {}
+_device_locks_guard = threading.Lock()
+
+def device_lock(device_mac):
+    with _device_locks_guard:
+        return _device_locks.setdefault(device_mac, threading.Lock())
+
+# Bring one lock in line with its bookings. The state store holds the snapshot of what was last
+# applied to the lock, so a poll only turns into lock calls for the bookings that changed since.
+# Locks run concurrently but each lock only sees one call at a time
+def reconcile_lock(home, codes, prune=True):
+    device_mac = home.lock_device_mac
+    store = state_store.get_store()
+    with device_lock(device_mac), metrics.timed('provision', home=home.name):
+        now = now_utc()
+        snapshot = {booking['uid']: booking for booking in store.bookings_for_home(home.name)}
+        # rows recorded by --list-upcoming or a failed first sync were never applied to the lock,
+        # so until a code is provisioned the whole calendar is compared with the lock
+        if not any(booking['provisioned_at'] for booking in snapshot.values()):
+            if prune:
+                for uid in snapshot.keys() - {code[0] for code in codes}:
+                    store.forget(home.name, uid)
+            if codes:
+                full_reconcile(home, codes, now, prune)
+        else:
+            changes = booking_changes.diff(snapshot, codes, now, prune=prune)
+            for uid in changes.forget:
+                store.forget(home.name, uid)
+            if changes:
+                print(f"{home.name}: {changes.summary()}")
+                apply_changes(home, changes, now)
+        # catch up on check-outs that passed while the daemon was down, whose delete failed or whose
+        # cleanup ran where the lease was held; the diff leaves stays that are over to cleanup
+        if prune and store.expired(device_mac, now):
+            delete_access_codes(device_mac, now)
+
+# First sync of a home on this machine, or of one with no code provisioned yet: compare every booking
+# with the keys on the lock
+def full_reconcile(home, codes, now, prune=True):
+    device_mac = home.lock_device_mac
+    store = state_store.get_store()
+    store.record_bookings(home.name, device_mac, [code for code in codes if code[3] > now])
+    # on a lock shared by several homes the codes of the others are left to them
+    shared = [(row['uid'], row['code'], row['check_in'], row['check_out'])
+              for row in store.bookings_for_lock(device_mac) if row['home'] != home.name]
+    keys = get_lock_keys(device_mac)
+    to_create, to_delete, matched = reconcile.plan(device_mac, codes, keys, now, prune=prune, shared=shared)
+    # a key created earlier in this process has to be read back from the lock before it can be deleted
+    if any(key.id is None for key in to_delete):
+        keys = get_lock_keys(device_mac, require_ids=True)
+        to_create, to_delete, matched = reconcile.plan(device_mac, codes, keys, now, prune=prune, shared=shared)
+    for (uid, code, check_in, check_out), key in matched:
+        store.mark_provisioned(home.name, uid, key.id)  # id is None for a key created in this process
+    delete_keys(device_mac, [key.id for key in to_delete])
+    create_codes(home, to_create)
+
+# Revoke cancelled codes, move changed ones in place and create new ones, one batch of each per lock
+def apply_changes(home, changes, now):
+    device_mac = home.lock_device_mac
+    store = state_store.get_store()
+    registry = metrics.get_metrics()
+    # a failed delete keeps the row, so the next poll sees the cancellation again
+    for row in revoke_rows(home.name, device_mac, changes.removed):
+        registry.inc('booking_changes_total', home=home.name, change='cancelled')
+        print(f"Revoked code for cancelled booking {row['uid']} at {home.name}")
+    added = list(changes.added)
+    move = []
+    key_ids = resolve_key_ids(device_mac, [row for row, code in changes.changed])
+    for (row, (uid, code, check_in, check_out)), key_id in zip(changes.changed, key_ids):
+        if key_id is None:
+            # the old code is no longer on the lock, set it again
+            added.append((uid, code, check_in, check_out))
+        else:
+            move.append((key_id, (uid, code, check_in, check_out)))
+    for (key_id, (uid, code, check_in, check_out)), updated in zip(move, update_keys(device_mac, move)):
+        if updated:
+            store.update_booking(home.name, uid, code, check_in, check_out, key_id)
+            registry.inc('booking_changes_total', home=home.name, change='changed')
+            notifier.get_dispatcher().add(home.name, code, check_in, check_out)
+    if added:
+        store.record_bookings(home.name, device_mac, added)
+        # a code may already be on the lock, e.g. when an earlier create timed out after reaching it
+        to_create, to_delete, matched = reconcile.plan(device_mac, added, get_lock_keys(device_mac), now, prune=False)
+        for (uid, code, check_in, check_out), key in matched:
+            store.mark_provisioned(home.name, uid, key.id)
+        create_codes(home, to_create)
+        registry.inc('booking_changes_total', len(added), home=home.name, change='added')
+
+def create_codes(home, codes):
+    store = state_store.get_store()
+    for (uid, code, check_in, check_out), key_id in zip(codes, create_keys(home.lock_device_mac, codes)):
+        if key_id is not False:
+            store.mark_provisioned(home.name, uid, key_id)
+            notifier.get_dispatcher().add(home.name, code, check_in, check_out)
+
+# (name, window end) -> key id for the keys this script manages on a lock
+def managed_key_ids(device_mac):
+    keys = get_lock_keys(device_mac, require_ids=True)
+    return {(key.name, reconcile.key_end(key)): key.id for key in keys if reconcile.is_managed(key)}
+
+# Key id of each state store row, None when its code is not on the lock. Codes created by this
+# script only learn their key id the next time the lock is read
+def resolve_key_ids(device_mac, rows):
+    key_ids = {}
+    if any(row['key_id'] is None for row in rows):
+        key_ids = managed_key_ids(device_mac)
+    return [row['key_id'] or key_ids.get((row['name'], reconcile.end_stamp(row['check_out']))) for row in rows]
+
+# Delete the codes of a home's state store rows in one batch and forget the rows. A row whose code is
+# no longer on the lock is forgotten right away, a failed delete keeps its row. Returns the rows revoked
+def revoke_rows(home_name, device_mac, rows):
+    store = state_store.get_store()
+    revoke = []
+    for row, key_id in zip(rows, resolve_key_ids(device_mac, rows)):
+        if key_id is None:
+            store.forget(home_name, row['uid'])
+        else:
+            revoke.append((row, key_id))
+    revoked = []
+    for (row, key_id), deleted in zip(revoke, delete_keys(device_mac, [key_id for row, key_id in revoke])):
+        if deleted:
+            store.forget(home_name, row['uid'])
+            revoked.append(row)
+    return revoked
+
+# Only homes this process holds the lease on are synced, the rest belong to another worker or copy
+def sync_homes(homes, select_codes, prune=True):
+    lease_manager = leases.get_lease_manager()
+    held = lease_manager.claim([home.name for home in homes])
+    skipped = [home.name for home in homes if home.name not in held]
+    if skipped and lease_manager.shard[1] == 1:
+        print(f"Skipping homes leased by another process: {', '.join(skipped)}")
     try:
-        # Validate access_code as a string
-        if not re.match(r'\d{4,8}$', str(access_code)):  # Ensure the check is on the string representation
-            raise ValueError("Access code must be a 4-8 digit number")
-        response = client.locks.create_access_code(
-            device_mac=device_mac,
-            access_code=str(access_code).encode(),  # Correct to encode after validation
-            name=name,
-            permission=permission,
-            periodicity=periodicity
-        )
-        #send email notification
-        sendEmail(home=device_mac, lock=access_code, check_in=check_in, check_out=check_out)
-        print(f"Access code {access_code} created for {name} in {device_mac}")
-    except WyzeApiError as e:
-        print(f"Failed to create access code for {name} in {device_mac}: {e}")
-    except ValueError as e:
-        print(f"Validation error: {e}")
-    except WyzeRequestError as e:
-        print(f"Error retrieving encryption secret: {e}")
-    except Exception as e:
-        print(f"Unexpected error while creating access code for {name} with data {access_code}: {e}")
-
-
-def delete_access_codes(device_mac, check_out_time):
-    keys = client.locks.get_keys(device_mac=device_mac)
-    for key in keys:
-        if key.name.endswith(f"days") and datetime.strptime(key.periodicity.end_time, "%Y-%m-%dT%H:%M:%S") <= check_out_time:
+        _sync_homes([home for home in homes if home.name in held], select_codes, prune)
+    finally:
+        lease_manager.release_borrowed(held)
+
+# Sync pipeline: feeds download concurrently and each lock starts provisioning as soon as its feed is parsed
+def _sync_homes(homes, select_codes, prune=True):
+    registry = metrics.get_metrics()
+    with metrics.timed('sync'), ThreadPoolExecutor(max_workers=LOCK_MAX_WORKERS) as lock_pool:
+        futures = {}
+        fetched = {}
+        for home, bookings in fetch_all_bookings(homes):
+            bookings = fetched[home.name] = normalize_bookings(home, bookings)
+            codes = select_codes(home, bookings)
+            registry.set('home_bookings', len(bookings), home=home.name)
+            registry.set('home_codes', len(codes), home=home.name)
+            if codes or prune:
+                futures[lock_pool.submit(reconcile_lock, home, codes, prune)] = home
+        update_timeline(fetched)
+        for future in as_completed(futures):
             try:
-                client.locks.delete_access_code(
-                    device_mac=device_mac,
-                    access_code_id=key.id
-                )
-                print(f"Access code {key.id} deleted from {device_mac}")
-            except WyzeApiError as e:
-                print(f"Failed to delete access code {key.id} from {device_mac}: {e}")
+                future.result()
+            except Exception as e:
+                print(f"Failed to provision access codes for {futures[future].name}: {e}")
+    # one digest email per home for the codes set this cycle, sent in the background
+    notifier.get_dispatcher().flush()
+
+def access_code(code, check_in, check_out):
+    return lock_backends.AccessCode(str(code), reconcile.code_name(check_in, check_out), check_in, check_out)
+
+# Set codes for (uid, code, check_in, check_out) bookings on a lock in one batch. Returns, per booking,
+# the new key's id (None when the lock does not report it) or False when the code could not be set
+def create_keys(device_mac, codes):
+    if not codes:
+        return []
+    requested = [access_code(code, check_in, check_out) for uid, code, check_in, check_out in codes]
+    results = []
+    for request, outcome in zip(requested, lock_backends.get_backend().create_many(device_mac, requested)):
+        if outcome.error is not None:
+            print(f"Failed to create access code for {request.name} in {device_mac}: {outcome.error}")
+            results.append(False)
+            continue
+        key_inventory.get_inventory().record_created(device_mac, reconcile.pending_key(request.begin, request.end, outcome.key_id))
+        print(f"Access code {request.code} created for {request.name} in {device_mac}")
+        results.append(outcome.key_id)
+    return results
+
+# Move existing codes to their booking's new window (and code) without deleting them.
+# moves are (key_id, (uid, code, check_in, check_out)), returns True or False for each
+def update_keys(device_mac, moves):
+    if not moves:
+        return []
+    requested = [(key_id, access_code(code, check_in, check_out)) for key_id, (uid, code, check_in, check_out) in moves]
+    results = []
+    for (key_id, request), outcome in zip(requested, lock_backends.get_backend().update_many(device_mac, requested)):
+        if outcome.error is not None:
+            print(f"Failed to update access code {key_id} for {request.name} in {device_mac}: {outcome.error}")
+            results.append(False)
+            continue
+        key_inventory.get_inventory().record_updated(device_mac, reconcile.pending_key(request.begin, request.end, key_id))
+        print(f"Access code {key_id} updated to {request.name} in {device_mac}")
+        results.append(True)
+    return results
+
+# Remove the codes whose stay ended, looked up in the state store rather than by scanning the lock
+def delete_access_codes(device_mac, check_out_time):
+    with metrics.timed('cleanup', lock=device_mac):
+        _delete_expired_codes(device_mac, check_out_time)
+
+def _delete_expired_codes(device_mac, check_out_time):
+    # a lock shared by several homes holds rows of each of them
+    by_home = {}
+    for booking in state_store.get_store().expired(device_mac, check_out_time):
+        by_home.setdefault(booking['home'], []).append(booking)
+    for home_name, bookings in by_home.items():
+        revoke_rows(home_name, device_mac, bookings)
+
+# Delete keys from a lock in one batch, returns True or False for each. A failed delete keeps its
+# booking in the state store, so the next sync cycle retries it
+def delete_keys(device_mac, key_ids):
+    if not key_ids:
+        return []
+    results = []
+    for key_id, outcome in zip(key_ids, lock_backends.get_backend().delete_many(device_mac, key_ids)):
+        if outcome.error is not None:
+            print(f"Failed to delete access code {key_id} from {device_mac}: {outcome.error}")
+            results.append(False)
+            continue
+        key_inventory.get_inventory().record_deleted(device_mac, key_id)
+        print(f"Access code {key_id} deleted from {device_mac}")
+        results.append(True)
+    return results
 
 def process_bookings():
-    for home in HOMES:
-        bookings = fetch_airbnb_bookings(home['ical_url'])
-        for booking in bookings:
-            check_in = booking['check_in'].replace(hour=int(home['check_in_time'].split(':')[0]), minute=int(home['check_in_time'].split(':')[1]))
-            check_out = booking['check_out'].replace(hour=int(home['check_out_time'].split(':')[0]), minute=int(home['check_out_time'].split(':')[1]))
-            create_access_code(home['lock_device_mac'], booking['guest_phone_last4'], check_in, check_out)
-
-def schedule_cleanup_jobs():
-    for home in HOMES:
-        schedule_time = home['check_out_time']
-        schedule.every().day.at(schedule_time).do(cleanup_access_codes_for_home, home)
+    sync_homes(get_homes(), booking_codes)
 
 def cleanup_access_codes_for_home(home):
-    current_time = datetime.now().replace(hour=int(home['check_out_time'].split(':')[0]), minute=int(home['check_out_time'].split(':')[1]), second=0, microsecond=0)
-    delete_access_codes(home['lock_device_mac'], current_time)
+    lease_manager = leases.get_lease_manager()
+    held = lease_manager.claim([home.name])
+    try:
+        if held:
+            delete_access_codes(home.lock_device_mac, timeline.check_out_today(home))
+    finally:
+        lease_manager.release_borrowed(held)
+
+_planned_events = set()
+
+# Plan the exact moments something has to happen for known bookings: a sync of the home shortly
+# before check-in, and code removal right at check-out
+def schedule_booking_events(scheduler):
+    global _planned_events
+    lease_manager = leases.get_lease_manager()
+    homes = {home.name: home for home in get_homes() if lease_manager.holds(home.name)}
+    now = now_utc()
+    lead = timedelta(minutes=CODE_LEAD_MINUTES)
+    horizon = now + timedelta(hours=PLAN_HORIZON_HOURS)
+    bookings = get_timeline()
+    planned = set()
+    for booking in bookings.starting(now + lead, horizon + lead):
+        home = homes.get(booking.home)
+        if home:
+            key = f"activate:{home.name}:{booking.uid}"
+            scheduler.schedule(booking.check_in - lead, key, sync_homes, [home], booking_codes)
+            planned.add(key)
+    for booking in bookings.ending(now, horizon):
+        home = homes.get(booking.home)
+        if home:
+            key = f"checkout:{home.name}:{booking.uid}"
+            scheduler.schedule(booking.check_out, key, cleanup_access_codes_for_home, home)
+            planned.add(key)
+    # bookings that disappeared from the feeds
+    for key in _planned_events - planned:
+        scheduler.cancel(key)
+    _planned_events = planned
+
+def sync_cycle(scheduler):
+    try:
+        process_bookings()
+        schedule_booking_events(scheduler)
+    finally:
+        scheduler.schedule(clock.now() + timedelta(minutes=FEED_REFRESH_MINUTES), 'sync', sync_cycle, scheduler)
 
-# Schedule tasks
-schedule.every(15).minutes.do(process_bookings)
-schedule.every().day.at("00:00").do(lambda: list_upcoming_bookings())  # Schedule listing of upcoming bookings at midnight daily
-schedule_cleanup_jobs()
+def daily_listing(scheduler):
+    try:
+        list_upcoming_bookings()
+    finally:
+        midnight = datetime.combine(clock.now().date() + timedelta(days=1), datetime.min.time())
+        scheduler.schedule(midnight, 'daily-listing', daily_listing, scheduler)
+
+# The daemon's recurring jobs: a feed sync right away, then the listing of upcoming bookings at midnight daily
+def start_jobs(scheduler):
+    scheduler.schedule(clock.time(), 'sync', sync_cycle, scheduler)
+    midnight = datetime.combine(clock.now().date() + timedelta(days=1), datetime.min.time())
+    scheduler.schedule(midnight, 'daily-listing', daily_listing, scheduler)
+
+# Key inventory and API scheduler counters, read by the metrics endpoint on every scrape
+def runtime_stats():
+    import api_scheduler
+    inventory = key_inventory.get_inventory().stats()
+    stats = {f'key_inventory_{name}': value for name, value in inventory.items()}
+    stats.update({f'api_scheduler_{name}': value for name, value in api_scheduler.get_scheduler().stats().items()})
+    return stats
+
+# Switch to a new list of homes without a restart. Only the homes that were added or changed are
+# synced, a changed feed or lock drops what was cached for the old one, and the events of removed
+# homes are cancelled. Scheduled events of the other homes are left as they are
+def apply_homes(homes, scheduler=None):
+    import feed_cache
+    global HOMES
+    before = {home.name: home for home in get_homes()}
+    after = {home.name: home for home in homes}
+    added = [home for name, home in after.items() if name not in before]
+    removed = [home for name, home in before.items() if name not in after]
+    changed = [(before[name], home) for name, home in after.items() if name in before and before[name] != home]
+    HOMES = list(homes)
+    if not (added or removed or changed):
+        return
+    print(f"Home configuration changed: {len(added)} added, {len(changed)} changed, {len(removed)} removed")
+    cache = feed_cache.get_cache()
+    store = state_store.get_store()
+    for old, new in changed:
+        if old.ical_url != new.ical_url:
+            cache.invalidate(old.ical_url)
+        if old.lock_device_mac != new.lock_device_mac:
+            # codes already on the old lock are left to expire, the new lock is reconciled from scratch
+            key_inventory.get_inventory().invalidate(old.lock_device_mac)
+            store.forget_home(new.name)
+    for home in removed:
+        cache.invalidate(home.ical_url)
+    update_timeline({home.name: [] for home in removed})
+    lease_manager = leases.get_lease_manager()
+    lease_manager.release([home.name for home in removed])
+    lease_manager.watch([home.name for home in HOMES])
+    touched = added + [new for old, new in changed]
+    if touched:
+        sync_homes(touched, booking_codes)
+    if scheduler is not None:
+        schedule_booking_events(scheduler)
+
+# Poll the home config file and apply edits, a file that does not validate is reported and ignored
+def watch_config(scheduler, watcher):
+    try:
+        homes = watcher.poll()
+        if homes is not None:
+            apply_homes(homes, scheduler)
+    except home_config.ConfigError as e:
+        print(f"Ignoring invalid {watcher.path}, keeping the current homes: {e}")
+    except OSError as e:
+        print(f"Failed to read {watcher.path}: {e}")
+    finally:
+        scheduler.schedule(clock.time() + home_config.CONFIG_POLL_SECONDS, 'config', watch_config, scheduler, watcher)
+
+# Daemon: sleep until the next due event instead of polling. SIGHUP forces an immediate sync
+def run_daemon():
+    registry = metrics.get_metrics()
+    registry.register_collector(runtime_stats)
+    registry.serve()
+    scheduler = event_scheduler.EventScheduler(clock=clock.time)
+    start_jobs(scheduler)
+    if home_config.uses_file():
+        watcher = home_config.ConfigWatcher()
+        scheduler.schedule(clock.time() + home_config.CONFIG_POLL_SECONDS, 'config', watch_config, scheduler, watcher)
+    # SIGHUP re-reads the config file, if there is one, and syncs now
+    def on_hangup(signum, frame):
+        scheduler.trigger('config')
+        scheduler.trigger('sync')
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, on_hangup)
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+    # homes of a crashed worker are synced here as soon as their lease runs out
+    lease_manager = leases.get_lease_manager()
+    lease_manager.start_renewal([home.name for home in get_homes()], on_orphaned=lambda homes: scheduler.trigger('sync'))
+    try:
+        scheduler.run_forever()
+    finally:
+        lease_manager.stop()
+        lease_manager.release_all()
+        notifier.get_dispatcher().close()
+
+# Start `count` daemon workers, each owning the homes that hash to its index, and restart any that exits
+def run_supervisor(count):
+    import api_scheduler
+    import feed_cache
+    script = os.path.abspath(__file__)
+    workers = {}
+    delays = {}
+    restarts = {}
+    stopping = threading.Event()
+
+    def start(index):
+        env = dict(os.environ)
+        # workers share the API rate limit and burst, and each keeps its own feed cache file for its homes
+        env['API_RATE_PER_SECOND'] = str(api_scheduler.API_RATE_PER_SECOND / count)
+        env['API_BURST'] = str(max(api_scheduler.API_BURST // count, 1))
+        env['FEED_CACHE_PATH'] = f"{feed_cache.FEED_CACHE_PATH}.worker{index}"
+        if metrics.METRICS_PORT:
+            env['METRICS_PORT'] = str(metrics.METRICS_PORT + index)
+        workers[index] = (subprocess.Popen([sys.executable, script, '--workers', str(count), '--worker', str(index)], env=env), time.time())
+        print(f"Started worker {index} (pid {workers[index][0].pid})")
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+    for index in range(count):
+        start(index)
+    while not stopping.wait(1):
+        for index, (process, started) in list(workers.items()):
+            if index in restarts:
+                if time.time() >= restarts[index]:
+                    del restarts[index]
+                    start(index)
+                continue
+            code = process.poll()
+            if code is None:
+                continue
+            # back off while a worker keeps dying right after starting
+            if time.time() - started < 60 and index in delays:
+                delays[index] = min(delays[index] * 2, 300)
+            else:
+                delays[index] = WORKER_RESTART_DELAY
+            restarts[index] = time.time() + delays[index]
+            print(f"Worker {index} exited with code {code}, restarting in {delays[index]}s")
+    for process, started in workers.values():
+        if process.poll() is None:
+            process.terminate()
+    for process, started in workers.values():
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+# Save the feed bodies and lock calls of this run to an archive that --replay can run against later
+def start_recording(path):
+    import feed_cache
+    import replay
+    recorder = replay.ArchiveWriter(path)
+    recorder.write_homes(get_homes())
+    feed_cache.get_session().hooks['response'].append(recorder.record_response)
+    lock_backends.get_backend().recorder = recorder
+    # a cached feed would only answer 304, start from full bodies so the archive has every feed
+    cache = feed_cache.get_cache()
+    for home in get_homes():
+        cache.invalidate(home.ical_url)
+    print(f"Recording feeds and Wyze calls to {path}")
+
+# Run the daemon's jobs against a recorded archive on a virtual clock, in a throwaway state
+# database and feed cache, with the locks held in memory starting from the keys first read from them.
+# Prints what the locks were asked to do; log_path gets every lock change as JSON lines, sorted so
+# runs of two versions can be diffed
+def run_replay(path, days=30, log_path=None):
+    import feed_cache
+    import replay
+    global HOMES
+    archive = replay.Archive(path)
+    HOMES = archive.homes()
+    start = archive.start()
+    virtual = clock.use_virtual(start)
+    workdir = tempfile.mkdtemp(prefix='wyze-replay-')
+    locks = lock_backends.InMemoryLockBackend(archive.initial_keys())
+    emails = []
+    try:
+        state_store.use_store(state_store.StateStore(os.path.join(workdir, 'state.db')))
+        feed_cache.use_cache(feed_cache.FeedCache(os.path.join(workdir, 'feed_cache.json')))
+        lease_manager = leases.LeaseManager(os.path.join(workdir, 'state.db'))
+        lease_manager.keep = True
+        leases.use_lease_manager(lease_manager)
+        feed_cache.get_session().mount(replay.SCHEME, replay.ReplayAdapter(archive))
+        lock_backends.use_backend(locks)
+        notifier.get_dispatcher().sink = lambda home, codes: emails.append({'at': clock.time(), 'op': 'email', 'home': home, 'codes': len(codes)})
+        scheduler = event_scheduler.EventScheduler(clock=clock.time)
+        start_jobs(scheduler)
+        began = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            scheduler.run_until(start + days * 86400, virtual.advance_to)
+        elapsed = time.perf_counter() - began
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    log = sorted(locks.log + emails, key=lambda entry: (entry['at'], entry['op'], entry.get('lock') or entry.get('home'), entry.get('name') or '', entry.get('end') or 0))
+    changes = ', '.join(f"{count} {op}" for op, count in sorted(locks.changes.items())) or "none"
+    print(f"Replayed {days} days of {len(HOMES)} homes from {path} in {elapsed:.2f}s")
+    print(f"Lock changes: {changes}; {sum(locks.requests.values())} lock requests; {len(emails)} emails")
+    if log_path:
+        with open(log_path, 'w') as f:
+            for entry in log:
+                f.write(json.dumps(entry) + '\n')
+        print(f"Wrote {len(log)} lock changes and emails to {log_path}")
 
 def main():
     parser = argparse.ArgumentParser(description="Wyze Lock Airbnb Automation Script")
     parser.add_argument('--list-upcoming', action='store_true', help="List upcoming bookings for the next 7 days")
     parser.add_argument('--set-days', type=int, help="Set access codes for bookings in the next specified number of days")
     parser.add_argument('--testemail', action='store_true', help="Send a test email to verify email configuration")
+    parser.add_argument('--workers', type=int, default=1, help="Run the daemon as this many worker processes, homes are split between them")
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--record', metavar='DIR', help="Save the iCal responses and Wyze API calls of this run to an archive")
+    parser.add_argument('--replay', metavar='DIR', help="Run the scheduled jobs against a recorded archive on a virtual clock")
+    parser.add_argument('--replay-days', type=int, default=30, help="Days of virtual time to replay (default 30)")
+    parser.add_argument('--replay-log', metavar='FILE', help="Write the lock changes and emails of a replay as JSON lines")
     args = parser.parse_args()
 
+    if args.replay:
+        run_replay(args.replay, args.replay_days, args.replay_log)
+        return
+    if args.record:
+        if args.workers > 1:
+            print("--record works with a single daemon process, run it without --workers")
+            return
+        start_recording(args.record)
+
     if args.testemail:
         # Define the test email details
         test_email = os.getenv('MAIL_TO')
@@ -314,17 +707,23 @@ def main():
         test_body = "This is a test email to verify the email configuration."
         sendTestEmail(test_email, test_subject, test_body)
         return  # Use return to exit the function after sending test email
-    elif args.list_upcoming:
-        client = get_client()  # Initialize Wyze client only if not testing email
+
+    # the other modes all work on the homes, load them here so a bad config file stops the script right away
+    get_homes()
+    if args.list_upcoming:
         list_upcoming_bookings()
     elif args.set_days:
-        client = get_client()  # Initialize Wyze client only if not testing email
         process_bookings_for_days(args.set_days)
+        notifier.get_dispatcher().close()
+    elif args.workers > 1 and args.worker is None:
+        run_supervisor(args.workers)
     else:
-        client = get_client()  # Initialize Wyze client only if not testing email
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
+        if args.worker is not None:
+            leases.get_lease_manager().set_shard(args.worker, args.workers)
+        # long running, keep the access token fresh instead of waiting for it to be rejected
+        import token_manager
+        token_manager.get_token_manager().start_background_refresh()
+        run_daemon()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file